@@ -0,0 +1,108 @@
+# Incrementally maintained authentication rollups for the admin dashboard
+#
+# AuthRollup folds authentication events into per-status and per-user counts, an
+# hourly success rate and per-user failure streaks. It remembers the id of the last
+# event it has seen (the log offset), so each dashboard render only reads and folds
+# the events that arrived since the previous one. Rendered charts are cached under
+# the same offset and are only redrawn when new events have actually come in.
+
+import io
+import threading
+from collections import Counter
+from datetime import datetime
+
+SUCCESS_STATUSES = ('SUCCESS',)
+STREAK_ALERT = 3  # consecutive failures worth flagging on the dashboard
+
+
+class AuthRollup:
+    def __init__(self):
+        self.last_id = 0
+        self.status_counts = Counter()
+        self.user_counts = Counter()
+        self.hourly = {}          # hour start (epoch seconds) -> [successes, attempts]
+        self.current_streak = {}  # username -> consecutive failures up to the latest event
+        self.longest_streak = {}  # username -> longest run of consecutive failures
+        self._charts = {}         # chart name -> (last_id, png bytes)
+        self._lock = threading.Lock()
+
+    def update(self, store):
+        # Fold in events newer than last_id; returns how many were added
+        with self._lock:
+            rows = store.auth_events_since(self.last_id)
+            for event_id, ts, username, status in rows:
+                self._fold(ts, username, status)
+                self.last_id = event_id
+            return len(rows)
+
+    def _fold(self, ts, username, status):
+        self.status_counts[status] += 1
+        self.user_counts[username] += 1
+        success = status in SUCCESS_STATUSES
+        bucket = self.hourly.setdefault(int(ts // 3600) * 3600, [0, 0])
+        bucket[0] += success
+        bucket[1] += 1
+        if success:
+            self.current_streak[username] = 0
+        else:
+            streak = self.current_streak.get(username, 0) + 1
+            self.current_streak[username] = streak
+            if streak > self.longest_streak.get(username, 0):
+                self.longest_streak[username] = streak
+
+    @property
+    def total(self):
+        return sum(self.status_counts.values())
+
+    def hourly_success_rate(self, hours=None):
+        # [(hour as datetime, success rate, attempts)], oldest first; the last `hours` buckets with data
+        keys = sorted(self.hourly)
+        if hours is not None:
+            keys = keys[-hours:]
+        return [(datetime.fromtimestamp(k), self.hourly[k][0] / self.hourly[k][1], self.hourly[k][1])
+                for k in keys]
+
+    def failure_streaks(self, min_streak=STREAK_ALERT):
+        # [(username, current streak, longest streak)] for users whose current run is at least min_streak
+        rows = [(u, s, self.longest_streak[u]) for u, s in self.current_streak.items() if s >= min_streak]
+        return sorted(rows, key=lambda r: -r[1])
+
+    def status_chart_png(self):
+        # Bar chart of status counts, redrawn only when new events have been folded in
+        with self._lock:
+            cached = self._charts.get('status')
+            if cached and cached[0] == self.last_id:
+                return cached[1]
+            png = self._render_status_chart()
+            self._charts['status'] = (self.last_id, png)
+            return png
+
+    def _render_status_chart(self):
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots()
+        statuses = [s for s, _ in self.status_counts.most_common()]
+        ax.bar(statuses, [self.status_counts[s] for s in statuses],
+               color=['green' if s in SUCCESS_STATUSES else 'red' for s in statuses])
+        ax.set_ylabel('Count')
+        ax.set_title('Authentication Success vs Failure')
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png', bbox_inches='tight')
+        plt.close(fig)
+        return buf.getvalue()
+
+
+_shared_rollups = {}
+_shared_lock = threading.Lock()
+
+
+def get_auth_rollup(store):
+    # One rollup per event store and process, brought up to date on every call
+    with _shared_lock:
+        rollup = _shared_rollups.get(store.path)
+        if rollup is None:
+            rollup = AuthRollup()
+            _shared_rollups[store.path] = rollup
+    rollup.update(store)
+    return rollup
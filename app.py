@@ -1,11 +1,18 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
 import cv2
 import torch
 import numpy as np
-from facenet_pytorch import MTCNN, InceptionResnetV1
+from models import get_models
 import os
 from datetime import datetime
 from werkzeug.utils import secure_filename
+from gallery import get_gallery, capture_paths, select_templates
+from search import search_gallery
+from embedding_service import get_embedding_service
+from detection import detect_face
+from audit_store import AuditStore
+from inference_pool import create_pool, PoolBusy
+from metrics import get_registry, stage, profile, AUTH_SECONDS, AUTH_TOTAL
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'
@@ -14,35 +21,117 @@ USER_FOLDER = 'users'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 SIMILARITY_THRESHOLD = 0.6
 
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
 if not os.path.exists(USER_FOLDER):
     os.makedirs(USER_FOLDER)
 
-mtcnn = MTCNN(image_size=160, margin=0, min_face_size=40)
-resnet = InceptionResnetV1(pretrained='vggface2').eval()
+mtcnn, resnet = get_models()
+embedder = get_embedding_service(resnet)
+# Authentication uploads are decoded in memory; copies are kept only if auditing is enabled
+audit_store = AuditStore(os.path.join(UPLOAD_FOLDER, 'audit'))
+# With CBT_INFERENCE_WORKERS > 0 (or --workers) detection and embedding run in worker processes
+inference_pool = create_pool()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def load_user_embeddings():
-    user_embeddings = []
-    user_names = []
-    for fname in os.listdir(USER_FOLDER):
-        if fname.lower().endswith(tuple(ALLOWED_EXTENSIONS)):
-            img_path = os.path.join(USER_FOLDER, fname)
-            img = cv2.imread(img_path)
-            if img is None:
-                continue
-            rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            face = mtcnn(rgb)
-            if face is not None:
-                emb = resnet(face.unsqueeze(0)).detach().numpy()
-                user_embeddings.append(emb)
-                user_names.append(os.path.splitext(fname)[0])
-    if user_embeddings:
-        user_embeddings = np.vstack(user_embeddings)
-    return user_embeddings, user_names
+def decode_upload(file):
+    # Read the upload straight from the request stream; returns (raw bytes, RGB array or None)
+    data = file.read()
+    if inference_pool is not None:
+        return data, None  # the worker decodes it
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return data, None
+    return data, cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+def embed_upload(data, rgb, source='flask'):
+    # (status, embedding) with status 'ok', 'no_face' or 'invalid_image'; raises PoolBusy when saturated
+    if inference_pool is not None:
+        with stage(source, 'pool'):  # queueing plus decode, detection and embedding in a worker
+            return inference_pool.embed(data)
+    if rgb is None:
+        return 'invalid_image', None
+    with stage(source, 'detect'):
+        face = detect_face(mtcnn, rgb)
+    if face is None:
+        return 'no_face', None
+    with stage(source, 'embed'):
+        return 'ok', embedder.embed(face)
+
+def authenticate_upload(data, rgb, ext):
+    # Shared by the HTML form and the JSON API
+    status, emb = embed_upload(data, rgb)
+    if status != 'ok':
+        if status == 'no_face':
+            with stage('flask', 'audit'):
+                audit_store.save(data, ext, 'NOFACE')
+        return {'status': status}
+    with stage('flask', 'gallery'):  # reloads the index if another process changed it
+        gallery = get_gallery()
+    if len(gallery) == 0:
+        return {'status': 'no_users'}
+    with stage('flask', 'search'):
+        name, best_sim = search_gallery(gallery, emb, k=1)[0]
+    if best_sim > SIMILARITY_THRESHOLD:
+        with stage('flask', 'audit'):
+            audit_store.save(data, ext, 'SUCCESS')
+        return {'status': 'authenticated', 'name': name, 'similarity': round(float(best_sim), 4)}
+    with stage('flask', 'audit'):
+        audit_store.save(data, ext, 'FAIL')
+    return {'status': 'not_recognized', 'similarity': round(float(best_sim), 4)}
+
+def authenticate_file(file, ext):
+    # Decode and authenticate one upload, timing the whole attempt and counting its outcome
+    with AUTH_SECONDS.time(source='flask'), profile('flask_authenticate'):
+        try:
+            with stage('flask', 'decode'):
+                data, rgb = decode_upload(file)
+            result = authenticate_upload(data, rgb, ext)
+        except PoolBusy:
+            AUTH_TOTAL.inc(source='flask', status='busy')
+            raise
+    AUTH_TOTAL.inc(source='flask', status=result['status'])
+    return result
+
+def register_upload(username, uploads):
+    # uploads: [(data, rgb, ext)], one per capture. Several captures are enrolled as
+    # separate templates under users/<name>/, minus any outlier among them.
+    name = secure_filename(username)
+    # Embed before writing any photo so a saturated pool doesn't leave unindexed files behind
+    embedded = [(data, ext, *embed_upload(data, rgb, 'flask_register')) for data, rgb, ext in uploads]
+    if any(status == 'invalid_image' for _, _, status, _ in embedded):
+        return {'status': 'invalid_image'}
+    faces = [(data, ext, emb) for data, ext, status, emb in embedded if status == 'ok']
+    if not faces:
+        # Kept so the photos show up for the admin; sync records them as having no face
+        for (data, ext, _, _), path in zip(embedded, capture_paths(USER_FOLDER, name, [e[1] for e in embedded])):
+            with open(path, 'wb') as f:
+                f.write(data)
+        return {'status': 'registered_no_face', 'username': name}
+    gallery = get_gallery()
+    keep = select_templates(gallery.get(name), [emb for _, _, emb in faces])
+    faces = [face for face, ok in zip(faces, keep) if ok]
+    if not faces:
+        # Outliers against the enrolled templates, or the user already has MAX_TEMPLATES;
+        # nothing is written, so no folder is created and the gallery revision is unchanged
+        return {'status': 'rejected', 'username': name, 'rejected': len(uploads)}
+    items = []
+    for (data, _, emb), path in zip(faces, capture_paths(USER_FOLDER, name, [f[1] for f in faces])):
+        with open(path, 'wb') as f:
+            f.write(data)
+        items.append((name, emb, path))
+    gallery.add_many(items)
+    return {'status': 'registered', 'username': name, 'templates': len(items),
+            'rejected': len(uploads) - len(items)}
+
+def busy_response():
+    response = jsonify({'status': 'busy', 'error': 'Server is at capacity, retry shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+# Embed new or changed photos in users/ once at startup
+get_gallery().sync(USER_FOLDER, mtcnn, resnet)
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -55,28 +144,21 @@ def index():
             flash('No selected file')
             return redirect(request.url)
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(filepath)
-            # Authenticate
-            img = cv2.imread(filepath)
-            rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            face = mtcnn(rgb)
-            if face is None:
+            ext = file.filename.rsplit('.', 1)[1].lower()
+            try:
+                result = authenticate_file(file, ext)
+            except PoolBusy:
+                flash('The server is busy, please try again in a moment.')
+                return render_template('index.html'), 503
+            status = result['status']
+            if status == 'invalid_image':
+                flash('Could not read the uploaded image.')
+            elif status == 'no_face':
                 flash('No face detected in uploaded image.')
-                return redirect(request.url)
-            face = face.unsqueeze(0)
-            emb = resnet(face).detach().numpy()
-            user_embeddings, user_names = load_user_embeddings()
-            if user_embeddings is None or len(user_embeddings) == 0:
+            elif status == 'no_users':
                 flash('No registered users found.')
-                return redirect(request.url)
-            sims = np.dot(user_embeddings, emb.T) / (np.linalg.norm(user_embeddings, axis=1, keepdims=True) * np.linalg.norm(emb))
-            best_idx = np.argmax(sims)
-            best_sim = sims[best_idx][0]
-            if best_sim > SIMILARITY_THRESHOLD:
-                name = user_names[best_idx]
-                flash(f'Authenticated: {name}! (Similarity: {best_sim:.2f})')
+            elif status == 'authenticated':
+                flash(f"Authenticated: {result['name']}! (Similarity: {result['similarity']:.2f})")
             else:
                 flash('Face not recognized.')
             return redirect(request.url)
@@ -88,18 +170,123 @@ def register():
         if 'file' not in request.files or 'username' not in request.form:
             flash('Missing file or username')
             return redirect(request.url)
-        file = request.files['file']
+        files = [f for f in request.files.getlist('file') if f.filename != '']
         username = request.form['username']
-        if file.filename == '' or username.strip() == '':
+        if not files or username.strip() == '':
             flash('No selected file or username')
             return redirect(request.url)
-        if file and allowed_file(file.filename):
-            filename = secure_filename(username + '.' + file.filename.rsplit('.', 1)[1].lower())
-            filepath = os.path.join(USER_FOLDER, filename)
-            file.save(filepath)
-            flash(f'User {username} registered!')
+        if all(allowed_file(f.filename) for f in files):
+            uploads = [(*decode_upload(f), f.filename.rsplit('.', 1)[1].lower()) for f in files]
+            try:
+                result = register_upload(username, uploads)
+            except PoolBusy:
+                flash('The server is busy, please try again in a moment.')
+                return render_template('register.html'), 503
+            if result['status'] == 'registered':
+                flash(f'User {username} registered!')
+                if result['rejected']:
+                    flash(f"{result['rejected']} photo(s) did not match the others and were not used.")
+            elif result['status'] == 'registered_no_face':
+                flash(f'User {username} registered, but no face was detected in the photo.')
+            elif result['status'] == 'rejected':
+                flash(f'No photo was enrolled for {username}: they did not match the enrolled photos '
+                      'or the user already has the maximum number of photos.')
+                return render_template('register.html'), 422
+            else:
+                flash('Could not read the uploaded image.')
             return redirect(url_for('register'))
     return render_template('register.html')
 
+# JSON variants of / and /register for kiosk clients
+def api_uploads():
+    # [(file, ext)] from the multipart 'file' field(s), or (None, error response)
+    files = [f for f in request.files.getlist('file') if f.filename != '']
+    if not files:
+        return None, (jsonify({'status': 'error', 'error': 'Missing file'}), 400)
+    if not all(allowed_file(f.filename) for f in files):
+        return None, (jsonify({'status': 'error', 'error': 'Unsupported file type'}), 400)
+    return [(f, f.filename.rsplit('.', 1)[1].lower()) for f in files], None
+
+@app.route('/api/authenticate', methods=['POST'])
+def api_authenticate():
+    uploads, error = api_uploads()
+    if error:
+        return error
+    file, ext = uploads[0]
+    try:
+        result = authenticate_file(file, ext)
+    except PoolBusy:
+        return busy_response()
+    code = 400 if result['status'] == 'invalid_image' else 200
+    return jsonify(result), code
+
+@app.route('/api/register', methods=['POST'])
+def api_register():
+    username = request.form.get('username', '').strip()
+    if not username:
+        return jsonify({'status': 'error', 'error': 'Missing username'}), 400
+    uploads, error = api_uploads()
+    if error:
+        return error
+    try:
+        result = register_upload(username, [(*decode_upload(f), ext) for f, ext in uploads])
+    except PoolBusy:
+        return busy_response()
+    code = {'invalid_image': 400, 'rejected': 422}.get(result['status'], 201)
+    return jsonify(result), code
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text format; per process, so scrape each server process separately
+    registry = get_registry()
+    registry.gauge('cbt_gallery_templates', 'Enrolled face templates').set(len(get_gallery()))
+    service = embedder.stats()
+    registry.gauge('cbt_embed_batches', 'Batches run by the embedding service').set(service['batches'])
+    registry.gauge('cbt_embed_mean_batch', 'Mean embedding batch size').set(service['mean_batch'])
+    if inference_pool is not None:
+        pool = inference_pool.stats()
+        registry.gauge('cbt_pool_in_flight', 'Requests queued or running in the inference pool').set(pool['in_flight'])
+        registry.gauge('cbt_pool_rejected', 'Requests turned away with 503 since start').set(pool['rejected'])
+        registry.gauge('cbt_pool_timed_out', 'Requests that waited past CBT_REQUEST_TIMEOUT').set(pool['timed_out'])
+    return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/api/health')
+def api_health():
+    return jsonify({'users': len(get_gallery()),
+                    'pool': inference_pool.stats() if inference_pool is not None else None})
+
+# Production serving: `python app.py --serve` runs waitress when it is installed
+# (pip install waitress), or run any WSGI server on app:app with the pool configured
+# through the environment, e.g.
+#   CBT_INFERENCE_WORKERS=4 gunicorn --workers 1 --threads 16 app:app
+# Keep one web process per host: each one starts its own inference pool.
 if __name__ == '__main__':
-    app.run(debug=True)
+    import argparse
+    parser = argparse.ArgumentParser(description='Face authentication web app')
+    parser.add_argument('--serve', action='store_true',
+                        help='production mode: waitress WSGI server, no debugger or reloader')
+    parser.add_argument('--workers', type=int, default=None, help='inference worker processes')
+    parser.add_argument('--threads-per-worker', type=int, default=0, help='torch threads per worker')
+    parser.add_argument('--max-pending', type=int, default=0, help='queued requests before answering 503')
+    parser.add_argument('--threads', type=int, default=16, help='request threads of the --serve server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+    if args.workers is not None:
+        # Replaces the pool configured from CBT_INFERENCE_WORKERS at import
+        if inference_pool is not None:
+            inference_pool.shutdown()
+        inference_pool = create_pool(args.workers, args.threads_per_worker, args.max_pending)
+    if args.serve:
+        if inference_pool is not None:
+            inference_pool.warm_up()
+            print(f'Inference pool: {inference_pool.stats()}')
+        try:
+            from waitress import serve
+        except ImportError:
+            print('waitress is not installed (pip install waitress); using the Werkzeug development server')
+            app.run(host=args.host, port=args.port, threaded=True, debug=False)
+        else:
+            serve(app, host=args.host, port=args.port, threads=args.threads)
+    else:
+        app.run(host=args.host, port=args.port, debug=True)
@@ -1,87 +1,146 @@
 import streamlit as st
-import cv2
 import numpy as np
 import torch
-from facenet_pytorch import MTCNN, InceptionResnetV1
+from models import get_models, model_metrics
 import os
-from datetime import datetime
 from PIL import Image
 import random
 import time
-import json
+import shutil
+from gallery import get_gallery, capture_paths, select_templates, list_photos, photo_owner, MAX_TEMPLATES
+from search import normalize
+from embedding_service import get_embedding_service
+from detection import detect_face
+from event_store import get_event_store
+from analytics import get_auth_rollup
+from exam_store import get_exam_store
+from exam_sessions import get_session_store
+from question_bank import get_question_bank, paper_seed
+from grading import grade_paper, ResponseMatrix, item_analysis, score_distribution
+from reports import start_report_job, get_report_job, report_card_pdf
+from thumbnails import thumbnail
+from metrics import stage, profile, AUTH_SECONDS, AUTH_TOTAL, AUTH_STAGE_SECONDS, get_profiler
 
 USER_FOLDER = 'users'
-LOG_FILE = 'auth_log.txt'
 SIMILARITY_THRESHOLD = 0.6
-USER_TIME_FILE = 'user_time_limits.json'
+RESULTS_PAGE_SIZE = 200
+USERS_PAGE_SIZE = 24
+USER_GRID_COLUMNS = 6
+DEFAULT_TIME_LIMIT = 120
+EXAM_COURSE = os.environ.get('CBT_EXAM_COURSE') or None  # None: questions from every course
+EXAM_PAPER_SIZE = int(os.environ.get('CBT_PAPER_SIZE', 0))  # 0: every question in the course
+DIFFICULTIES = ['', 'easy', 'medium', 'hard']
 
 # --- Helper for per-user time limit ---
-def get_user_time_limit(username, default=120):
-    if os.path.exists(USER_TIME_FILE):
-        with open(USER_TIME_FILE, 'r') as f:
-            data = json.load(f)
-        return data.get(username, default)
-    return default
+def get_user_time_limit(username, default=DEFAULT_TIME_LIMIT):
+    return get_exam_store().get_time_limit(username, default)
 
 def set_user_time_limit(username, seconds):
-    data = {}
-    if os.path.exists(USER_TIME_FILE):
-        with open(USER_TIME_FILE, 'r') as f:
-            data = json.load(f)
-    data[username] = seconds
-    with open(USER_TIME_FILE, 'w') as f:
-        json.dump(data, f)
+    get_exam_store().set_time_limit(username, seconds)
 
 # --- Manual reset for attempts ---
 def reset_user_attempt(username):
-    if os.path.exists('cbt_results.txt'):
-        with open('cbt_results.txt', 'r') as f:
-            lines = f.readlines()
-        with open('cbt_results.txt', 'w') as f:
-            for line in lines:
-                if username not in line:
-                    f.write(line)
+    get_session_store().discard(username)
+    return get_event_store().delete_results(username)
 
 # --- Utility Functions ---
 def log_attempt(user, result):
-    with open(LOG_FILE, 'a') as f:
-        f.write(f"{datetime.now()} - {user} - {result}\n")
+    get_event_store().log_auth(user, result, source='streamlit')
+
+def start_exam(username):
+    # Draws the candidate's paper from the cached bank, or returns their existing attempt
+    seed = paper_seed(username)
+    paper = get_question_bank(CBT_QUESTIONS).paper(seed, course=EXAM_COURSE, size=EXAM_PAPER_SIZE or None)
+    return get_session_store().start_or_resume(username, get_user_time_limit(username), paper.ids.tolist(), seed)
+
+def exam_summary(paper, answers, correct):
+    summary = []
+    for q, is_correct in zip(paper.questions(), correct):
+        user_idx = answers.get(q['id'])
+        summary.append({
+            'question': q['question'],
+            'your_answer': q['options'][user_idx] if user_idx is not None else None,
+            'correct_answer': q['options'][q['answer']],
+            'is_correct': bool(is_correct)
+        })
+    return summary
+
+def submit_exam(username, session, paper):
+    # Grades the autosaved answers; the result is recorded once even if two tabs submit
+    score, _ = grade_paper(paper, session.answers)
+    if get_session_store().submit(username, score):
+        get_event_store().record_result(username, score, len(paper))
 
 def load_users(user_folder, mtcnn, resnet):
-    user_embeddings = []
-    user_names = []
-    if not os.path.exists(user_folder):
-        os.makedirs(user_folder)
-    for fname in os.listdir(user_folder):
-        if fname.lower().endswith(('.jpg', '.jpeg', '.png')):
-            img_path = os.path.join(user_folder, fname)
-            img = cv2.imread(img_path)
-            if img is None:
-                continue
-            rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            face = mtcnn(rgb)
-            if face is not None:
-                emb = resnet(face.unsqueeze(0)).detach().numpy()
-                user_embeddings.append(emb)
-                user_names.append(os.path.splitext(fname)[0])
-    if not user_embeddings:
+    # Same persistent store as app.py and main.py; only new/changed images are embedded
+    gallery = get_gallery()
+    gallery.sync(user_folder, mtcnn, resnet)
+    if len(gallery) == 0:
         return None, None
-    user_embeddings = np.vstack(user_embeddings)
-    return user_embeddings, user_names
+    return gallery.embeddings, gallery.names
+
+def user_page(users, key, name=lambda u: u[0]):
+    # Search box and pager over the user index; returns the rows on the current page
+    query = st.text_input("Search users", key=f"{key}_search").strip().lower()
+    if query:
+        users = [u for u in users if query in name(u).lower()]
+    pages = max(1, -(-len(users) // USERS_PAGE_SIZE))
+    page = st.selectbox(f"Page ({len(users)} users)", range(1, pages + 1), key=f"{key}_page") if pages > 1 else 1
+    start = (page - 1) * USERS_PAGE_SIZE
+    return users[start:start + USERS_PAGE_SIZE]
+
+def delete_user_photos(username):
+    # Every photo sync would enrol for the user (users/<name>.* in any extension case),
+    # then the users/<name>/ folder of extra captures
+    for key in list_photos(USER_FOLDER):
+        if '/' not in key and photo_owner(key) == username:
+            os.remove(os.path.join(USER_FOLDER, key))
+    user_dir = os.path.join(USER_FOLDER, username)
+    if os.path.isdir(user_dir):
+        shutil.rmtree(user_dir)
 
-def save_user_image(username, image):
-    save_path = os.path.join(USER_FOLDER, f'{username}.jpg')
-    image.save(save_path)
-    return save_path
+def save_user_images(username, images):
+    # One capture is saved as users/<name>.jpg, several under users/<name>/
+    save_paths = capture_paths(USER_FOLDER, username, ['jpg'] * len(images))
+    for image, save_path in zip(images, save_paths):
+        image.save(save_path)
+    return save_paths
 
-def get_face_embedding(image, mtcnn, resnet):
+def get_face_embedding(image, mtcnn, resnet, source='streamlit_register'):
     img = np.array(image.convert('RGB'))
-    face = mtcnn(img)
+    with stage(source, 'detect'):
+        face = detect_face(mtcnn, img)
     if face is not None:
-        emb = resnet(face.unsqueeze(0)).detach().numpy()
-        return emb
+        # Batched with other sessions' logins by the shared embedding service
+        with stage(source, 'embed'):
+            return get_embedding_service(resnet).embed(face)
     return None
 
+def authenticate_capture(username, captured_image):
+    # 1:1 check of a capture against the user's templates; returns (status, similarity)
+    # with status 'SUCCESS', 'FAILED', 'no_face' or 'unknown_user'
+    user_img_path = os.path.join(USER_FOLDER, f"{username}.jpg")
+    with stage('streamlit', 'gallery'):
+        gallery = get_gallery()
+        if not (username in gallery or os.path.exists(user_img_path)):
+            return 'unknown_user', 0.0
+        # Enrolled embedding comes from the gallery; only the live capture is embedded
+        stored_embs = gallery.get(username)
+        if not len(stored_embs) and gallery.add_image(user_img_path, mtcnn, get_embedding_service(resnet), name=username):
+            stored_embs = gallery.get(username)
+    with stage('streamlit', 'decode'):
+        live_image = Image.open(captured_image)
+        live_image.load()
+    live_emb = get_face_embedding(live_image, mtcnn, resnet, source='streamlit')
+    if not len(stored_embs) or live_emb is None:
+        return 'no_face', 0.0
+    with stage('streamlit', 'compare'):
+        similarity = float(np.max(normalize(stored_embs) @ normalize(live_emb).T))
+    status = "SUCCESS" if similarity >= SIMILARITY_THRESHOLD else "FAILED"
+    with stage('streamlit', 'log'):
+        log_attempt(username, status)
+    return status, similarity
+
 # --- CBT Questions (example) ---
 CBT_QUESTIONS = [
     {
@@ -136,9 +195,8 @@ CBT_QUESTIONS = [
     }
 ]
 
-# --- Model Initialization ---
-mtcnn = MTCNN(image_size=160, margin=0, min_face_size=40)
-resnet = InceptionResnetV1(pretrained='vggface2').eval()
+# --- Model Initialization (loaded once per server process, reused across reruns) ---
+mtcnn, resnet = get_models()
 
 st.set_page_config(page_title="University of Ilorin CBT Portal with Facial Recognition", page_icon="🧑‍💻", layout="centered")
 
@@ -165,87 +223,89 @@ if choice == "Admin Login" and not st.session_state['admin_authenticated']:
 # --- Admin Dashboard (Secured) ---
 if choice == "Admin Login" and st.session_state['admin_authenticated']:
     st.title("Admin Dashboard")
-    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs([
-        "Analytics", "PDF Export", "User Management", "Time Limits", "Manual Reset", "Exam Questions", "Results"
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8 = st.tabs([
+        "Analytics", "PDF Export", "User Management", "Time Limits", "Manual Reset", "Exam Questions", "Results",
+        "Performance"
     ])
 
     # --- Analytics Tab ---
     with tab1:
         st.subheader("Authentication Analytics")
-        import matplotlib.pyplot as plt
         import pandas as pd
-        if os.path.exists(LOG_FILE):
-            with open(LOG_FILE, 'r') as f:
-                logs = [line.strip() for line in f if line.strip()]
-            if logs:
-                # Example log format: '2024-06-01 12:00:00 - user1 - SUCCESS'
-                data = [l.split('-') for l in logs]
-                # Clean up and only use the last 3 fields (strip whitespace)
-                data = [[x.strip() for x in row[-3:]] for row in data if len(row) >= 3]
-                df = pd.DataFrame(data, columns=["Timestamp", "Username", "Status"])
-                df['Timestamp'] = pd.to_datetime(df['Timestamp'], errors='coerce')
-                st.write("Recent Authentication Attempts:")
-                st.dataframe(df.tail(20))
-                # Plot success/failure counts
-                status_counts = df['Status'].value_counts()
-                fig, ax = plt.subplots()
-                status_counts.plot(kind='bar', ax=ax, color=['green', 'red'])
-                ax.set_ylabel('Count')
-                ax.set_title('Authentication Success vs Failure')
-                st.pyplot(fig)
-                # Per-user stats
-                user_counts = df['Username'].value_counts()
-                st.write("Authentication Attempts per User:")
-                st.bar_chart(user_counts)
-            else:
-                st.info("No authentication attempts logged yet.")
+        events = get_event_store()
+        # Rollups only fold in events logged since the previous render
+        rollup = get_auth_rollup(events)
+        if rollup.total:
+            recent = events.recent_auth(limit=20)
+            df = pd.DataFrame([(e['timestamp'], e['username'], e['status']) for e in recent],
+                              columns=["Timestamp", "Username", "Status"])
+            st.write("Recent Authentication Attempts:")
+            st.dataframe(df)
+            # Plot success/failure counts (redrawn only when new events arrive)
+            st.image(rollup.status_chart_png())
+            # Per-user stats
+            user_counts = pd.Series(dict(rollup.user_counts.most_common()))
+            st.write("Authentication Attempts per User:")
+            st.bar_chart(user_counts)
+            hourly = rollup.hourly_success_rate(hours=48)
+            if hourly:
+                st.write("Hourly Success Rate (last 48 active hours):")
+                st.line_chart(pd.Series({h: rate for h, rate, _ in hourly}))
+            streaks = rollup.failure_streaks()
+            if streaks:
+                st.warning("Users with repeated failed attempts:")
+                st.dataframe(pd.DataFrame(streaks, columns=["Username", "Current Streak", "Longest Streak"]))
         else:
-            st.info("No authentication log file found.")
+            st.info("No authentication attempts logged yet.")
+        with st.expander("Face model startup metrics"):
+            st.json(model_metrics())
+        with st.expander("Embedding service throughput"):
+            st.json(get_embedding_service(resnet).stats())
 
     # --- PDF Export Tab ---
     with tab2:
         st.subheader("Export Logs and Results as PDF")
-        from fpdf import FPDF
-        def export_pdf(log_file, result_file):
-            pdf = FPDF()
-            pdf.add_page()
-            pdf.set_font("Arial", size=12)
-            pdf.cell(200, 10, txt="Authentication Log", ln=True, align='C')
-            if os.path.exists(log_file):
-                with open(log_file, 'r') as f:
-                    for line in f:
-                        pdf.cell(200, 8, txt=line.strip(), ln=True)
-            else:
-                pdf.cell(200, 8, txt="No log file found.", ln=True)
-            pdf.add_page()
-            pdf.cell(200, 10, txt="CBT Results", ln=True, align='C')
-            if os.path.exists(result_file):
-                with open(result_file, 'r') as f:
-                    for line in f:
-                        pdf.cell(200, 8, txt=line.strip(), ln=True)
+        # Built by a background job and cached until new attempts or results are recorded
+        for kind, label in (("results", "Results & Report Cards"), ("auth_log", "Authentication Log")):
+            job = get_report_job(kind)
+            if st.button(f"Generate {label}", key=f"report_{kind}"):
+                job = start_report_job(kind)
+            if job is None:
+                continue
+            if job.running:
+                st.progress(job.progress, text=f"{label}: {job.done} / {job.total}")
+            elif job.state == 'failed':
+                st.error(f"{label} failed: {job.error}")
             else:
-                pdf.cell(200, 8, txt="No results file found.", ln=True)
-            return pdf.output(dest='S').encode('latin1')
-        if st.button("Export All as PDF"):
-            pdf_bytes = export_pdf(LOG_FILE, 'cbt_results.txt')
-            st.download_button("Download PDF", pdf_bytes, file_name="cbt_report.pdf")
+                with open(job.path, 'rb') as f:
+                    st.download_button(f"Download {label}", f, file_name=os.path.basename(job.path),
+                                       key=f"download_{kind}")
+        if any(job is not None and job.running for job in map(get_report_job, ("results", "auth_log"))):
+            time.sleep(1)
+            st.rerun()
 
     # --- User Management Tab ---
     with tab3:
         st.subheader("Registered Users")
-        user_files = [f for f in os.listdir(USER_FOLDER) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+        # Listed from the gallery index with cached thumbnails, one page at a time
+        user_files = get_gallery().users()
         if user_files:
-            for uf in user_files:
-                st.write(uf)
-                st.image(os.path.join(USER_FOLDER, uf), width=80)
+            page_users = user_page(user_files, "manage")
+            cols = st.columns(USER_GRID_COLUMNS)
+            for i, (uname, fname, sha1) in enumerate(page_users):
+                with cols[i % USER_GRID_COLUMNS]:
+                    thumb = thumbnail(os.path.join(USER_FOLDER, fname), sha1)
+                    if thumb:
+                        st.image(thumb, width=80)
+                    st.caption(fname)
             st.markdown("---")
             st.subheader("Delete User")
-            del_user = st.selectbox("Select user to delete", [os.path.splitext(f)[0] for f in user_files])
+            del_user = st.selectbox("Select user to delete", list(dict.fromkeys(u[0] for u in page_users)))
             admin_pin = st.text_input("Enter Admin PIN to confirm", type="password", key="del_pin")
             if st.button("Delete User"):
                 if admin_pin == "123456":  # Replace with secure PIN logic
-                    user_img = [f for f in user_files if os.path.splitext(f)[0] == del_user][0]
-                    os.remove(os.path.join(USER_FOLDER, user_img))
+                    delete_user_photos(del_user)
+                    get_gallery().remove(name=del_user)
                     st.success(f"User '{del_user}' deleted.")
                     st.rerun()
                 else:
@@ -256,9 +316,12 @@ if choice == "Admin Login" and st.session_state['admin_authenticated']:
     # --- Time Limits Tab ---
     with tab4:
         st.subheader("Per-User Time Limit Management")
-        for uf in user_files:
-            uname = os.path.splitext(uf)[0]
-            current_time = get_user_time_limit(uname)
+        usernames = list(dict.fromkeys(u[0] for u in user_files))
+        page_names = user_page(usernames, "limits", name=lambda u: u)
+        # Only the limits of the users on this page are read
+        limits = get_exam_store().time_limits(page_names)
+        for uname in page_names:
+            current_time = limits.get(uname, DEFAULT_TIME_LIMIT)
             new_time = st.number_input(f"Time limit for {uname} (seconds)", min_value=30, max_value=3600, value=current_time, step=10, key=f"time_{uname}_tab")
             if st.button(f"Update Time for {uname}", key=f"btn_time_{uname}"):
                 set_user_time_limit(uname, new_time)
@@ -269,75 +332,73 @@ if choice == "Admin Login" and st.session_state['admin_authenticated']:
         st.subheader("Manual Reset User Attempt")
         reset_user = st.text_input("Enter username to reset CBT attempt", key="reset_user_tab")
         if st.button("Reset Attempt", key="reset_btn_tab"):
-            reset_user_attempt(reset_user)
-            st.success(f"CBT attempt for '{reset_user}' has been reset.")
+            removed = reset_user_attempt(reset_user)
+            st.success(f"CBT attempt for '{reset_user}' has been reset ({removed} result(s) removed).")
 
     # --- Exam Questions Tab ---
     with tab6:
         st.subheader("Manage CBT Questions")
-        QUESTIONS_FILE = 'cbt_questions.json'
-        # Load questions
-        if os.path.exists(QUESTIONS_FILE):
-            with open(QUESTIONS_FILE, 'r') as f:
-                questions = json.load(f)
-        else:
-            questions = []
+        exam_store = get_exam_store()
+        # Load questions; edits and deletes are keyed by question id, one row per transaction
+        questions = exam_store.list_questions()
         # Display questions
         if questions:
             for idx, q in enumerate(questions):
                 st.markdown(f"**Q{idx+1}: {q['question']}**")
+                tags = [t for t in (q['course'], q['section'], q['difficulty']) if t]
+                if tags:
+                    st.caption(" · ".join(tags))
                 for i, opt in enumerate(q['options']):
                     st.write(f"{chr(65+i)}. {opt}")
                 st.write(f"Correct Answer: {chr(65+q['answer'])}")
                 col1, col2 = st.columns(2)
                 with col1:
-                    if st.button(f"Edit Q{idx+1}", key=f"editq{idx}"):
-                        st.session_state['edit_q_idx'] = idx
+                    if st.button(f"Edit Q{idx+1}", key=f"editq{q['id']}"):
+                        st.session_state['edit_q_id'] = q['id']
                 with col2:
-                    if st.button(f"Delete Q{idx+1}", key=f"delq{idx}"):
-                        questions.pop(idx)
-                        with open(QUESTIONS_FILE, 'w') as f:
-                            json.dump(questions, f, indent=2)
+                    if st.button(f"Delete Q{idx+1}", key=f"delq{q['id']}"):
+                        exam_store.delete_question(q['id'])
                         st.success("Question deleted.")
                         st.rerun()
         else:
             st.info("No questions set yet.")
         st.markdown("---")
         # Add/Edit question
-        if 'edit_q_idx' in st.session_state:
-            edit_idx = st.session_state['edit_q_idx']
-            q = questions[edit_idx]
+        editing = [q for q in questions if q['id'] == st.session_state.get('edit_q_id')]
+        if 'edit_q_id' in st.session_state and not editing:
+            # Deleted by another admin while this one was editing it
+            del st.session_state['edit_q_id']
+            st.warning("The question being edited no longer exists.")
+        if editing:
+            q = editing[0]
             q_text = st.text_input("Edit Question", value=q['question'], key="edit_q_text")
             options = [st.text_input(f"Option {chr(65+i)}", value=opt, key=f"edit_opt_{i}") for i, opt in enumerate(q['options'])]
             answer = st.selectbox("Correct Answer", options=[chr(65+i) for i in range(len(options))], index=q['answer'], key="edit_ans")
+            course = st.text_input("Course", value=q['course'], key="edit_course")
+            section = st.text_input("Section", value=q['section'], key="edit_section")
+            difficulty = st.selectbox("Difficulty", DIFFICULTIES, index=DIFFICULTIES.index(q['difficulty']) if q['difficulty'] in DIFFICULTIES else 0, key="edit_difficulty")
             if st.button("Save Changes", key="save_edit_q"):
-                questions[edit_idx] = {
-                    'question': q_text,
-                    'options': options,
-                    'answer': [chr(65+i) for i in range(len(options))].index(answer)
-                }
-                with open(QUESTIONS_FILE, 'w') as f:
-                    json.dump(questions, f, indent=2)
+                exam_store.update_question(q['id'], q_text, options,
+                                           [chr(65+i) for i in range(len(options))].index(answer),
+                                           course, section, difficulty)
                 st.success("Question updated.")
-                del st.session_state['edit_q_idx']
+                del st.session_state['edit_q_id']
                 st.rerun()
             if st.button("Cancel Edit", key="cancel_edit_q"):
-                del st.session_state['edit_q_idx']
+                del st.session_state['edit_q_id']
                 st.rerun()
         else:
             st.markdown("### Add New Question")
             new_q = st.text_input("Question Text", key="new_q_text")
             new_opts = [st.text_input(f"Option {chr(65+i)}", key=f"new_opt_{i}") for i in range(4)]
             new_ans = st.selectbox("Correct Answer", options=[chr(65+i) for i in range(4)], key="new_ans")
+            new_course = st.text_input("Course", key="new_course")
+            new_section = st.text_input("Section", key="new_section")
+            new_difficulty = st.selectbox("Difficulty", DIFFICULTIES, key="new_difficulty")
             if st.button("Add Question", key="add_q"):
                 if new_q and all(new_opts):
-                    questions.append({
-                        'question': new_q,
-                        'options': new_opts,
-                        'answer': [chr(65+i) for i in range(4)].index(new_ans)
-                    })
-                    with open(QUESTIONS_FILE, 'w') as f:
-                        json.dump(questions, f, indent=2)
+                    exam_store.add_question(new_q, new_opts, [chr(65+i) for i in range(4)].index(new_ans),
+                                            new_course, new_section, new_difficulty)
                     st.success("Question added.")
                     st.rerun()
                 else:
@@ -347,42 +408,76 @@ if choice == "Admin Login" and st.session_state['admin_authenticated']:
     with tab7:
         st.subheader("Student Results & Report Card")
         import pandas as pd
-        from fpdf import FPDF
-        results_file = 'cbt_results.txt'
-        if os.path.exists(results_file):
-            with open(results_file, 'r') as f:
-                lines = [line.strip() for line in f if line.strip()]
-            # Parse results: '2024-06-01 12:00:00 - user1 - Score: 8/10'
-            data = []
-            for l in lines:
-                try:
-                    dt, user, score = l.split(' - ')
-                    score_val = score.split(': ')[1]
-                    data.append({'Timestamp': dt, 'Username': user, 'Score': score_val})
-                except Exception:
-                    continue
-            if data:
-                df = pd.DataFrame(data)
-                st.dataframe(df)
-                st.markdown('---')
-                st.subheader('Generate Report Card')
-                users = df['Username'].unique().tolist()
-                selected_user = st.selectbox('Select student', users)
-                user_df = df[df['Username'] == selected_user]
-                if st.button('Generate Report Card PDF'):
-                    pdf = FPDF()
-                    pdf.add_page()
-                    pdf.set_font('Arial', 'B', 16)
-                    pdf.cell(200, 10, f"Report Card for {selected_user}", ln=True, align='C')
-                    pdf.set_font('Arial', '', 12)
-                    for idx, row in user_df.iterrows():
-                        pdf.cell(200, 10, f"{row['Timestamp']} - Score: {row['Score']}", ln=True)
-                    pdf_bytes = pdf.output(dest='S').encode('latin1')
-                    st.download_button(f"Download {selected_user} Report Card", pdf_bytes, file_name=f"{selected_user}_report_card.pdf")
+        events = get_event_store()
+        # Only the latest page is loaded; report cards query one student through the index
+        data = [{'Timestamp': r['timestamp'], 'Username': r['username'], 'Score': f"{r['score']}/{r['total']}"}
+                for r in events.results(limit=RESULTS_PAGE_SIZE)]
+        if data:
+            df = pd.DataFrame(data)
+            st.caption(f"Latest {len(df)} results")
+            st.dataframe(df)
+            st.markdown('---')
+            st.subheader('Generate Report Card')
+            users = events.result_users()
+            selected_user = st.selectbox('Select student', users)
+            if st.button('Generate Report Card PDF'):
+                pdf_bytes = report_card_pdf(selected_user, [(r['timestamp'], r['score'], r['total'])
+                                                            for r in events.results(username=selected_user)])
+                st.download_button(f"Download {selected_user} Report Card", pdf_bytes, file_name=f"{selected_user}_report_card.pdf")
+        else:
+            st.info('No results found.')
+        st.markdown('---')
+        st.subheader('Cohort Item Analysis')
+        bank = get_question_bank(CBT_QUESTIONS)
+        course_options = sorted(bank.courses)
+        analysis_course = st.selectbox('Course', course_options,
+                                       format_func=lambda c: c or '(no course)', key='analysis_course')
+        if st.button('Analyse Cohort', key='analyse_cohort'):
+            matrix = ResponseMatrix.from_sessions(get_session_store().submitted_sessions(), bank, analysis_course)
+            if len(matrix):
+                items = item_analysis(matrix, bank)
+                counts, edges = score_distribution(items['percent'])
+                st.write(f"{len(matrix)} candidates · mean {items['percent'].mean():.1f}% · "
+                         f"median {np.median(items['percent']):.1f}%")
+                st.bar_chart(pd.Series(counts, index=[f"{int(lo)}-{int(hi)}%" for lo, hi in zip(edges[:-1], edges[1:])]))
+                rows = []
+                for i, pos in enumerate(items['positions']):
+                    row = {'Question': bank.questions[pos]['question'], 'Presented': int(items['presented'][i]),
+                           'Difficulty': items['difficulty'][i], 'Discrimination': items['discrimination'][i],
+                           'Omitted': int(items['omitted'][i])}
+                    for o in range(items['distractors'].shape[1]):
+                        row[chr(65 + o)] = int(items['distractors'][i, o])
+                    rows.append(row)
+                st.dataframe(pd.DataFrame(rows))
             else:
-                st.info('No results found.')
+                st.info('No submitted exams for this course yet.')
+
+    # --- Performance Tab ---
+    with tab8:
+        st.subheader("Authentication Latency")
+        import pandas as pd
+        # Metrics of this Streamlit process; the Flask app serves its own on /metrics
+        totals = AUTH_SECONDS.snapshot()
+        if totals:
+            st.dataframe(pd.DataFrame([dict(source=k[0], **v) for k, v in totals.items()]).round(1))
+            stages = AUTH_STAGE_SECONDS.snapshot()
+            st.write("Per stage (ms):")
+            st.dataframe(pd.DataFrame([dict(source=k[0], stage=k[1], **v) for k, v in stages.items()]).round(1))
+            outcomes = AUTH_TOTAL.snapshot()
+            st.write("Outcomes:")
+            st.dataframe(pd.DataFrame([{'source': k[0], 'status': k[1], 'count': v} for k, v in outcomes.items()]))
+        else:
+            st.info("No authentication attempts timed in this process yet.")
+        profiler = get_profiler()
+        if profiler.enabled:
+            st.write(f"Slow attempts over {profiler.slow * 1000:.0f} ms are profiled to '{profiler.out_dir}/' "
+                     "as folded stacks (open with speedscope or flamegraph.pl).")
+            profiles = sorted(os.listdir(profiler.out_dir), reverse=True)[:10] if os.path.exists(profiler.out_dir) else []
+            for fname in profiles:
+                with open(os.path.join(profiler.out_dir, fname), "rb") as f:
+                    st.download_button(fname, f, file_name=fname, key=f"profile_{fname}")
         else:
-            st.info('No results file found.')
+            st.caption("Set CBT_PROFILE_SLOW_MS to capture flame-graph stacks of slow attempts.")
 
     if st.button("Logout Admin"):
         st.session_state['admin_authenticated'] = False
@@ -410,20 +505,37 @@ UIL/PG2023/1826 using advanced face recognition technology.<br>
 elif choice == "Register":
     st.title("User Registration")
     username = st.text_input("Username")
+    # Several captures (e.g. slightly different angles) are enrolled as separate templates
+    captures = st.session_state.setdefault('register_captures', [])
     captured_image = st.camera_input("Capture your face using webcam")
+    col_add, col_clear = st.columns(2)
+    if col_add.button("Add capture", disabled=captured_image is None or len(captures) >= MAX_TEMPLATES):
+        captures.append(Image.open(captured_image).convert('RGB'))
+    if col_clear.button("Clear captures", disabled=not captures):
+        captures.clear()
+    if captures:
+        st.image(captures, width=80, caption=[f"#{i + 1}" for i in range(len(captures))])
     if st.button("Register"):
+        images = list(captures) or ([Image.open(captured_image).convert('RGB')] if captured_image is not None else [])
         if not username:
             st.error("Username is required.")
-        elif captured_image is None:
+        elif not images:
             st.error("Face capture is required.")
         else:
-            image = Image.open(captured_image)
-            image = image.convert('RGB')
-            emb = get_face_embedding(image, mtcnn, resnet)
-            if emb is not None:
-                save_user_image(username, image)
+            faces = [(image, get_face_embedding(image, mtcnn, resnet)) for image in images]
+            faces = [(image, emb) for image, emb in faces if emb is not None]
+            gallery = get_gallery()
+            keep = select_templates(gallery.get(username), [emb for _, emb in faces]) if faces else []
+            faces = [face for face, ok in zip(faces, keep) if ok]
+            if faces:
+                save_paths = save_user_images(username, [image for image, _ in faces])
+                gallery.add_many([(username, emb, path) for (_, emb), path in zip(faces, save_paths)])
                 log_attempt(username, "SUCCESS")
+                captures.clear()
                 st.success("Registration successful! You can now authenticate to start your CBT.")
+                if len(faces) < len(images):
+                    st.warning(f"{len(images) - len(faces)} capture(s) had no clear face or did not match "
+                               "the others and were not used.")
             else:
                 st.error("Face embedding failed. Ensure your face is clearly visible in the capture.")
 
@@ -438,29 +550,21 @@ elif choice == "Authenticate & Start CBT":
         elif captured_image is None:
             st.error("Face capture is required.")
         else:
-            user_img_path = os.path.join(USER_FOLDER, f"{username}.jpg")
-            if os.path.exists(user_img_path):
-                stored_image = Image.open(user_img_path)
-                stored_emb = get_face_embedding(stored_image, mtcnn, resnet)
-                live_image = Image.open(captured_image)
-                live_emb = get_face_embedding(live_image, mtcnn, resnet)
-                if stored_emb is not None and live_emb is not None:
-                    similarity = np.dot(stored_emb, live_emb.T) / (np.linalg.norm(stored_emb) * np.linalg.norm(live_emb))
-                    if similarity >= SIMILARITY_THRESHOLD:
-                        log_attempt(username, "SUCCESS")
-                        st.success("Authentication successful! Redirecting to exam...")
-                        st.session_state['authenticated_user'] = username
-                        st.session_state['exam_started'] = False
-                        st.session_state['exam_answers'] = {}
-                        st.session_state['exam_current_q'] = 0
-                        st.session_state['exam_submitted'] = False
-                        st.experimental_set_query_params(page="Take Exam")
-                        st.rerun()
-                    else:
-                        log_attempt(username, "FAILED")
-                        st.error("Face does not match. Authentication failed.")
-                else:
-                    st.error("Face embedding failed. Try again.")
+            with AUTH_SECONDS.time(source='streamlit'), profile('streamlit_authenticate'):
+                status, similarity = authenticate_capture(username, captured_image)
+            AUTH_TOTAL.inc(source='streamlit', status=status)
+            if status == "SUCCESS":
+                st.success("Authentication successful! Redirecting to exam...")
+                st.session_state['authenticated_user'] = username
+                # Resumes an unfinished attempt (same paper, answers and deadline) after a reconnect;
+                # a submitted attempt is shown again rather than retaken until an admin resets it
+                start_exam(username)
+                st.experimental_set_query_params(page="Take Exam")
+                st.rerun()
+            elif status == "FAILED":
+                st.error("Face does not match. Authentication failed.")
+            elif status == "no_face":
+                st.error("Face embedding failed. Try again.")
             else:
                 st.error("User not found. Please register first.")
 
@@ -470,63 +574,53 @@ elif choice == "Take Exam":
         st.warning("You must authenticate first.")
         st.stop()
     username = st.session_state['authenticated_user']
-    QUESTIONS_FILE = 'cbt_questions.json'
-    if os.path.exists(QUESTIONS_FILE):
-        with open(QUESTIONS_FILE, 'r') as f:
-            questions = json.load(f)
-    else:
-        questions = CBT_QUESTIONS
-    total_questions = len(questions)
-    if 'exam_current_q' not in st.session_state:
-        st.session_state['exam_current_q'] = 0
-    if 'exam_answers' not in st.session_state:
-        st.session_state['exam_answers'] = {}
-    if 'exam_submitted' not in st.session_state:
-        st.session_state['exam_submitted'] = False
-    q_idx = st.session_state['exam_current_q']
-    if not st.session_state['exam_submitted']:
+    sessions = get_session_store()
+    session = sessions.get(username)
+    if session is None:
+        session, _ = start_exam(username)
+    # The paper is the candidate's own selection and order, referencing the cached bank
+    paper = get_question_bank(CBT_QUESTIONS).paper_from_ids(session.paper, session.seed)
+    total_questions = len(paper)
+    if total_questions == 0:
+        st.error("No questions are available for this exam.")
+        st.stop()
+    if session.is_open and session.expired:
+        # The deadline is enforced server-side: grade whatever was saved before time ran out
+        submit_exam(username, session, paper)
+        st.warning("Time is up. Your saved answers have been submitted.")
+    if session.is_open:
+        q_idx = min(session.current_q, total_questions - 1)
+        remaining = int(session.remaining())
         st.header(f"CBT Exam - Question {q_idx+1} of {total_questions}")
-        q = questions[q_idx]
-        answer = st.radio("Select your answer:", q['options'], key=f"exam_q_{q_idx}",
-                         index=q['options'].index(st.session_state['exam_answers'].get(q_idx, q['options'][0])) if q_idx in st.session_state['exam_answers'] else 0)
-        st.session_state['exam_answers'][q_idx] = answer
+        st.caption(f"Time remaining: {remaining // 60:02d}:{remaining % 60:02d}")
+        q = paper.question(q_idx)
+        order = paper.option_order(q_idx).tolist()
+        saved = session.answers.get(q['id'])
+        shown = st.radio("Select your answer:", range(len(order)), key=f"exam_q_{q['id']}",
+                         format_func=lambda i: q['options'][order[i]],
+                         index=order.index(saved) if saved in order else None)
+        # Nothing is preselected, so a question only counts as answered once an option is
+        # picked; only changes mark the session dirty and the autosave thread batches them
+        if shown is not None:
+            sessions.save_answer(username, q['id'], order[shown])
         col1, col2, col3 = st.columns([1,1,2])
         with col1:
             if st.button("Previous") and q_idx > 0:
-                st.session_state['exam_current_q'] -= 1
+                sessions.set_position(username, q_idx - 1)
                 st.rerun()
         with col2:
             if st.button("Next") and q_idx < total_questions-1:
-                st.session_state['exam_current_q'] += 1
+                sessions.set_position(username, q_idx + 1)
                 st.rerun()
         with col3:
             if st.button("Finish and Submit"):
-                # Grade exam
-                score = 0
-                summary = []
-                for idx, q in enumerate(questions):
-                    correct = q['options'][q['answer']]
-                    user_ans = st.session_state['exam_answers'].get(idx, None)
-                    is_correct = user_ans == correct
-                    summary.append({
-                        'question': q['question'],
-                        'your_answer': user_ans,
-                        'correct_answer': correct,
-                        'is_correct': is_correct
-                    })
-                    if is_correct:
-                        score += 1
-                with open('cbt_results.txt', 'a') as f:
-                    f.write(f"{datetime.now()} - {username} - Score: {score}/{total_questions}\n")
-                st.session_state['exam_submitted'] = True
-                st.session_state['exam_score'] = score
-                st.session_state['exam_summary'] = summary
+                submit_exam(username, session, paper)
                 st.success('You have successfully submitted your exam!')
                 st.rerun()
     else:
-        score = st.session_state['exam_score']
-        summary = st.session_state['exam_summary']
-        st.success(f"Exam submitted! Your score: {score} / {total_questions}")
+        summary = exam_summary(paper, session.answers, grade_paper(paper, session.answers)[1])
+        st.success(f"Exam submitted! Your score: {session.score} / {total_questions}")
+        st.caption("To sit the exam again, ask an administrator to reset your attempt.")
         st.markdown('---')
         st.subheader('Exam Summary')
         for idx, item in enumerate(summary):
@@ -0,0 +1,83 @@
+# Bounded store for authentication uploads kept for auditing
+#
+# app.py decodes uploads in memory; only when auditing is enabled is a copy written
+# here, under a unique name so concurrent logins never collide. The store keeps at most
+# AUDIT_MAX_MB megabytes and AUDIT_MAX_FILES files and drops anything older than
+# AUDIT_MAX_AGE_DAYS, evicting the oldest images first. AUDIT_MAX_MB=0 disables it.
+# The folder is dedicated to audit copies (uploads/audit/ rather than uploads/ itself):
+# every file in it counts against the limits and may be evicted.
+
+import os
+import time
+import uuid
+import threading
+from collections import deque
+from datetime import datetime
+
+AUDIT_FOLDER = os.path.join('uploads', 'audit')
+AUDIT_MAX_MB = float(os.environ.get('CBT_AUDIT_MAX_MB', 0))
+AUDIT_MAX_FILES = int(os.environ.get('CBT_AUDIT_MAX_FILES', 10000))
+AUDIT_MAX_AGE_DAYS = float(os.environ.get('CBT_AUDIT_MAX_AGE_DAYS', 30))
+
+
+class AuditStore:
+    def __init__(self, folder=AUDIT_FOLDER, max_mb=AUDIT_MAX_MB, max_files=AUDIT_MAX_FILES,
+                 max_age_days=AUDIT_MAX_AGE_DAYS):
+        self.folder = folder
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_files = max_files
+        self.max_age = max_age_days * 86400
+        self._lock = threading.Lock()
+        self._files = deque()  # (mtime, path, size), oldest first
+        self._total = 0
+        if self.enabled:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            self._scan()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.max_files > 0
+
+    def _scan(self):
+        files = []
+        for fname in os.listdir(self.folder):
+            path = os.path.join(self.folder, fname)
+            if os.path.isfile(path):
+                st = os.stat(path)
+                files.append((st.st_mtime, path, st.st_size))
+        files.sort()
+        self._files = deque(files)
+        self._total = sum(f[2] for f in files)
+        self._evict()
+
+    def _evict(self):
+        cutoff = time.time() - self.max_age
+        while self._files and (self._total > self.max_bytes or len(self._files) > self.max_files
+                               or self._files[0][0] < cutoff):
+            _, path, size = self._files.popleft()
+            self._total -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def save(self, data, ext, label=''):
+        # Returns the stored path, or None when auditing is disabled
+        if not self.enabled:
+            return None
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        suffix = f'_{label}' if label else ''
+        path = os.path.join(self.folder, f'{stamp}_{uuid.uuid4().hex[:12]}{suffix}.{ext}')
+        with open(path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            self._files.append((time.time(), path, len(data)))
+            self._total += len(data)
+            self._evict()
+        return path
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': self.enabled, 'files': len(self._files), 'bytes': self._total,
+                    'max_bytes': self.max_bytes, 'max_files': self.max_files}
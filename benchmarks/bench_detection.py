@@ -0,0 +1,73 @@
+# Benchmark downscaled MTCNN detection against full-resolution detection
+# Usage: python benchmarks/bench_detection.py [--images users] [--long-side 3000] [--fractions 0,0.05,0.1,0.2]
+#
+# Each enrolment photo is upscaled to --long-side pixels to imitate a phone upload,
+# then detected at full resolution (fraction 0) and at the scale detection.py picks
+# for each MIN_FACE_FRACTION. Detection rate counts images where a face was found;
+# box IoU compares the mapped-back box with the full-resolution box.
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from facenet_pytorch import MTCNN
+from models import MTCNN_OPTIONS
+from detection import detect, detection_scale
+from realtime import iou
+from gallery import IMAGE_EXTENSIONS
+
+
+def load_images(folder, long_side):
+    images = []
+    for fname in sorted(os.listdir(folder)):
+        if not fname.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        img = cv2.imread(os.path.join(folder, fname))
+        if img is None:
+            continue
+        scale = long_side / max(img.shape[:2])
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+        images.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark downscaled face detection')
+    parser.add_argument('--images', default='users')
+    parser.add_argument('--long-side', type=int, default=3000)
+    parser.add_argument('--fractions', default='0,0.05,0.1,0.2,0.3')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    mtcnn = MTCNN(**MTCNN_OPTIONS)
+    images = load_images(args.images, args.long_side)
+    if not images:
+        raise SystemExit(f'No images found in {args.images}')
+    print(f'{len(images)} images at long side {args.long_side}px, min_face_size={mtcnn.min_face_size}')
+    reference = [detect(mtcnn, img, 0)[0] for img in images]
+
+    print(f'{"fraction":>9}{"scale":>8}{"mean ms":>10}{"p95 ms":>9}{"detected":>10}{"box IoU":>9}')
+    for fraction in [float(f) for f in args.fractions.split(',')]:
+        times, found, ious = [], 0, []
+        for img, ref in zip(images, reference):
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                boxes, _ = detect(mtcnn, img, fraction)
+                times.append(time.perf_counter() - start)
+            if boxes is not None:
+                found += 1
+                if ref is not None:
+                    ious.append(iou(ref[0], boxes[0]))
+        scale = np.mean([detection_scale(img.shape, mtcnn.min_face_size, fraction) for img in images])
+        times = np.array(times) * 1000.0
+        mean_iou = f'{np.mean(ious):.3f}' if ious else '-'
+        print(f'{fraction:>9.2f}{scale:>8.3f}{times.mean():>10.1f}{np.percentile(times, 95):>9.1f}'
+              f'{found:>5}/{len(images):<4}{mean_iou:>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# Benchmark and validate the optimized embedding backends against eager fp32
+# Usage: python benchmarks/bench_embedding.py [--backends int8 torchscript onnx] [--limit 500] [--json out.json]
+#
+# Face crops come from the enrolment photos in users/ (random crops if there are
+# none). Each backend embeds the same crops as the fp32 reference; drift is reported
+# as the cosine between the two embeddings of each crop, and, when a gallery exists,
+# as how often 1:N search with the backend's embedding returns the same user as with
+# fp32. Latency is the median / p95 wall time of a forward pass at each batch size,
+# measured with the process's torch thread count (set --threads to match a worker).
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import cv2
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from facenet_pytorch import MTCNN, InceptionResnetV1
+
+from models import MTCNN_OPTIONS, RESNET_PRETRAINED
+from model_backends import BACKENDS, FACE_SHAPE, optimize_resnet
+from detection import detect_face
+from gallery import get_gallery, list_photos, USER_FOLDER
+from search import normalize, search_gallery
+
+EMBED_CHUNK = 32
+
+
+def load_faces(user_folder, mtcnn, limit):
+    faces = []
+    keys = list_photos(user_folder) if os.path.exists(user_folder) else []
+    for key in keys:
+        if len(faces) >= limit:
+            break
+        img = cv2.imread(os.path.join(user_folder, *key.split('/')))
+        if img is None:
+            continue
+        face = detect_face(mtcnn, cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+        if face is not None:
+            faces.append(face)
+    if not faces:
+        print(f'No faces found in {user_folder}/; using {limit} random crops (drift is less representative)')
+        return torch.rand(limit, *FACE_SHAPE) * 2 - 1
+    return torch.stack(faces)
+
+
+def embed_all(resnet, faces):
+    with torch.inference_mode():
+        return np.vstack([resnet(faces[i:i + EMBED_CHUNK]).numpy() for i in range(0, len(faces), EMBED_CHUNK)])
+
+
+def drift(reference, embeddings):
+    cos = (normalize(reference) * normalize(embeddings)).sum(axis=1)
+    return {'cosine_mean': float(cos.mean()), 'cosine_min': float(cos.min()),
+            'cosine_p1': float(np.percentile(cos, 1))}
+
+
+def top1_agreement(gallery, reference, embeddings):
+    if len(gallery) == 0:
+        return None
+    same = [search_gallery(gallery, a, k=1)[0][0] == search_gallery(gallery, b, k=1)[0][0]
+            for a, b in zip(reference, embeddings)]
+    return float(np.mean(same))
+
+
+def latency(resnet, batch_sizes, runs):
+    results = {}
+    with torch.inference_mode():
+        for batch in batch_sizes:
+            x = torch.rand(batch, *FACE_SHAPE)
+            for _ in range(3):
+                resnet(x)
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                resnet(x)
+                times.append(time.perf_counter() - start)
+            times = np.array(times) * 1000.0
+            results[batch] = {'median_ms': float(np.median(times)), 'p95_ms': float(np.percentile(times, 95)),
+                              'per_face_ms': float(np.median(times) / batch)}
+    return results
+
+
+def validate(backends, user_folder=USER_FOLDER, limit=500, batch_sizes=(1, 16), runs=30):
+    mtcnn = MTCNN(**MTCNN_OPTIONS)
+    fp32 = InceptionResnetV1(pretrained=RESNET_PRETRAINED).eval()
+    faces = load_faces(user_folder, mtcnn, limit)
+    reference = embed_all(fp32, faces)
+    gallery = get_gallery()
+    report = {'faces': len(faces), 'threads': torch.get_num_threads(), 'backends': {}}
+    for backend in ['eager'] + [b for b in backends if b != 'eager']:
+        start = time.perf_counter()
+        resnet = optimize_resnet(fp32, backend, name=f'resnet_{RESNET_PRETRAINED}')
+        build_s = time.perf_counter() - start
+        if backend != 'eager' and resnet is fp32:
+            report['backends'][backend] = {'error': 'unavailable'}
+            continue
+        embeddings = embed_all(resnet, faces)
+        report['backends'][backend] = dict(drift(reference, embeddings), build_s=build_s,
+                                           top1_agreement=top1_agreement(gallery, reference, embeddings),
+                                           latency=latency(resnet, batch_sizes, runs))
+    return report
+
+
+def print_report(report):
+    print(f"Faces: {report['faces']}, torch threads: {report['threads']}")
+    batches = list(report['backends']['eager']['latency'])
+    eager = report['backends']['eager']['latency']
+    print(f'{"backend":<13}{"cos mean":>10}{"cos min":>10}{"top-1 agree":>13}{"build s":>9}' +
+          ''.join(f'{f"b{b} ms":>10}{"p95":>8}{"speedup":>9}' for b in batches))
+    for backend, r in report['backends'].items():
+        if 'error' in r:
+            print(f'{backend:<13}{r["error"]:>10}')
+            continue
+        agreement = '-' if r['top1_agreement'] is None else f"{r['top1_agreement']:.3f}"
+        print(f"{backend:<13}{r['cosine_mean']:>10.5f}{r['cosine_min']:>10.5f}{agreement:>13}{r['build_s']:>9.1f}" +
+              ''.join(f"{v['median_ms']:>10.1f}{v['p95_ms']:>8.1f}{eager[b]['median_ms'] / v['median_ms']:>9.2f}"
+                      for b, v in r['latency'].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare embedding backends with eager fp32')
+    parser.add_argument('--backends', nargs='+', default=[b for b in BACKENDS if b != 'eager'], choices=BACKENDS)
+    parser.add_argument('--users', default=USER_FOLDER, help='Folder of enrolment photos to embed')
+    parser.add_argument('--limit', type=int, default=500, help='Maximum number of faces')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 16], help='Batch sizes to time')
+    parser.add_argument('--runs', type=int, default=30, help='Timed forward passes per batch size')
+    parser.add_argument('--threads', type=int, default=0, help='torch threads (default: torch default)')
+    parser.add_argument('--json', help='Also write the report to this file')
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    report = validate(args.backends, args.users, args.limit, args.batch, args.runs)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# Benchmark 1:N search backends on a synthetic gallery
+# Usage: python benchmarks/bench_search.py --size 50000 --queries 500 --nprobe 1,4,8,16,32
+#
+# Compares the original per-query path (re-normalising the whole gallery on every
+# lookup, as app.index() and main.py used to), the pre-normalized brute-force index,
+# brute force over float16 / int8 codes (CompactIndex) and the IVF index at several
+# nprobe settings. Recall@1 is measured against exact brute-force results, so 1.000
+# means the approximate index never changed the answer; MB is the index's own memory.
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from search import BruteForceIndex, CompactIndex, IVFIndex, normalize
+
+
+def synthetic_gallery(size, dim=512, clusters=256, spread=0.6, seed=0):
+    # Identities scattered around a few hundred centres, loosely like real face embeddings
+    rng = np.random.default_rng(seed)
+    centres = normalize(rng.standard_normal((clusters, dim)))
+    members = centres[rng.integers(0, clusters, size)]
+    gallery = normalize(members + spread * rng.standard_normal((size, dim)) / np.sqrt(dim) * 4)
+    return gallery.astype(np.float32)
+
+
+def synthetic_queries(gallery, count, noise=0.35, seed=1):
+    # Fresh captures of enrolled users: gallery rows plus capture noise
+    rng = np.random.default_rng(seed)
+    truth = rng.integers(0, len(gallery), count)
+    dim = gallery.shape[1]
+    queries = normalize(gallery[truth] + noise * rng.standard_normal((count, dim)) / np.sqrt(dim) * 4)
+    return queries.astype(np.float32), truth
+
+
+def legacy_search(user_embeddings, emb):
+    sims = np.dot(user_embeddings, emb.T) / (np.linalg.norm(user_embeddings, axis=1, keepdims=True) * np.linalg.norm(emb))
+    return int(np.argmax(sims))
+
+
+def timed(fn, queries):
+    start = time.perf_counter()
+    results = [fn(q[None, :]) for q in queries]
+    elapsed = time.perf_counter() - start
+    return np.array(results), len(queries) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark 1:N search backends')
+    parser.add_argument('--size', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--nprobe', default='1,4,8,16,32')
+    args = parser.parse_args()
+
+    gallery = synthetic_gallery(args.size)
+    queries, _ = synthetic_queries(gallery, args.queries)
+    print(f'Gallery: {args.size} x {gallery.shape[1]}, queries: {args.queries}')
+
+    legacy, legacy_qps = timed(lambda q: legacy_search(gallery, q), queries)
+
+    start = time.perf_counter()
+    brute = BruteForceIndex().build(gallery)
+    brute_build = time.perf_counter() - start
+    exact, brute_qps = timed(lambda q: brute.search(q, 1)[0][0, 0], queries)
+
+    start = time.perf_counter()
+    ivf = IVFIndex(nlist=args.nlist).build(gallery)
+    ivf_build = time.perf_counter() - start
+
+    print(f'{"backend":<28}{"recall@1":>10}{"queries/s":>12}{"build s":>10}{"MB":>8}')
+    print(f'{"legacy (per-query norm)":<28}{np.mean(legacy == exact):>10.3f}{legacy_qps:>12.1f}{0:>10.2f}'
+          f'{gallery.nbytes / 1e6:>8.1f}')
+    print(f'{"brute (pre-normalized)":<28}{1.0:>10.3f}{brute_qps:>12.1f}{brute_build:>10.2f}'
+          f'{brute.vectors.nbytes / 1e6:>8.1f}')
+    for storage in ('float16', 'int8'):
+        start = time.perf_counter()
+        compact = CompactIndex(storage).build(gallery)
+        compact_build = time.perf_counter() - start
+        found, qps = timed(lambda q: compact.search(q, 1)[0][0, 0], queries)
+        print(f'{"brute " + storage:<28}{np.mean(found == exact):>10.3f}{qps:>12.1f}{compact_build:>10.2f}'
+              f'{compact.nbytes / 1e6:>8.1f}')
+    for nprobe in [int(n) for n in args.nprobe.split(',')]:
+        found, qps = timed(lambda q: ivf.search(q, 1, nprobe=nprobe)[0][0, 0], queries)
+        label = f'ivf nlist={len(ivf.centroids)} nprobe={nprobe}'
+        print(f'{label:<28}{np.mean(found == exact):>10.3f}{qps:>12.1f}{ivf_build:>10.2f}'
+              f'{ivf.vectors.nbytes / 1e6:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
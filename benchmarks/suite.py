@@ -0,0 +1,344 @@
+# Offline benchmark suite for the recognition and exam pipelines
+# Usage: python benchmarks/suite.py [--users 10000] [--only detection,search] [--label v2]
+#                                   [--compare benchmarks/results/v1.json] [--fail-on-regression]
+#
+# Everything runs on synthetic data in a temporary directory, so it needs no camera,
+# enrolment photos or network: images are generated, the gallery is --users synthetic
+# identities with --templates embeddings each, and the exam and results data are
+# seeded. MTCNN rarely finds a face in the generated images, so pass --images to time
+# detection on real photos instead. InceptionResnetV1 uses its pretrained weights
+# when they are cached and random weights otherwise, which changes accuracy but not speed.
+#
+# Each case reports latency percentiles over --repeat runs and throughput in items per
+# second. Results are written to benchmarks/results/<label>.json together with the
+# parameters and library versions; --compare prints the change in median latency
+# against an earlier file and flags cases slower by more than --threshold.
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+import subprocess
+from datetime import datetime
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_search import synthetic_gallery, synthetic_queries
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+CASES = ('detection', 'embedding', 'search', 'enrolment', 'grading', 'results')
+
+
+def measure(fn, repeat, items=1, warmup=2):
+    # Latency percentiles of fn() in ms, and items processed per second
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times = np.array(times)
+    return {'runs': repeat, 'items': items, 'mean_ms': float(times.mean() * 1000),
+            'p50_ms': float(np.percentile(times, 50) * 1000), 'p95_ms': float(np.percentile(times, 95) * 1000),
+            'p99_ms': float(np.percentile(times, 99) * 1000), 'per_s': float(items / times.mean())}
+
+
+# --- Synthetic data ---
+def synthetic_image(rng, height=480, width=640):
+    # Noisy background with a face-like blob: skin-tone ellipse, eyes and mouth
+    import cv2
+    img = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    img = cv2.GaussianBlur(img, (0, 0), 8)
+    cx, cy, r = width // 2 + int(rng.integers(-60, 60)), height // 2 + int(rng.integers(-40, 40)), height // 5
+    cv2.ellipse(img, (cx, cy), (int(r * 0.8), r), 0, 0, 360, (200, 160, 130), -1)
+    for dx in (-r // 3, r // 3):
+        cv2.circle(img, (cx + dx, cy - r // 4), r // 10, (40, 30, 30), -1)
+    cv2.ellipse(img, (cx, cy + r // 2), (r // 3, r // 10), 0, 0, 360, (120, 60, 60), -1)
+    return img
+
+
+def synthetic_questions(count, options=4, courses=4, sections=5, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{'id': i + 1, 'question': f'Question {i + 1}', 'options': [f'Option {o}' for o in range(options)],
+             'answer': int(rng.integers(0, options)), 'course': f'C{i % courses}', 'section': f'S{i % sections}',
+             'difficulty': ('easy', 'medium', 'hard')[i % 3]} for i in range(count)]
+
+
+def write_legacy_logs(folder, lines, users, seed=0):
+    rng = np.random.default_rng(seed)
+    start = datetime(2025, 1, 1).timestamp()
+    with open(os.path.join(folder, 'cbt_results.txt'), 'w') as f:
+        for i in range(lines):
+            ts = datetime.fromtimestamp(start + i * 7.5)
+            f.write(f'{ts} - user{rng.integers(0, users)} - Score: {rng.integers(0, 21)}/20\n')
+    with open(os.path.join(folder, 'auth_log.txt'), 'w') as f:
+        for i in range(lines):
+            ts = datetime.fromtimestamp(start + i * 3.1)
+            f.write(f"{ts} - user{rng.integers(0, users)} - {'SUCCESS' if rng.random() < 0.8 else 'FAILED'}\n")
+
+
+def load_images(folder, limit=32):
+    import cv2
+    from gallery import list_photos
+    images = []
+    for key in list_photos(folder)[:limit]:
+        img = cv2.imread(os.path.join(folder, *key.split('/')))
+        if img is not None:
+            images.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    return images
+
+
+def load_resnet(backend):
+    from facenet_pytorch import InceptionResnetV1
+    from models import RESNET_PRETRAINED
+    from model_backends import optimize_resnet
+    try:
+        resnet, weights = InceptionResnetV1(pretrained=RESNET_PRETRAINED).eval(), RESNET_PRETRAINED
+    except Exception:
+        resnet, weights = InceptionResnetV1().eval(), 'random'
+    return optimize_resnet(resnet, backend), weights
+
+
+# --- Cases ---
+def bench_detection(args, workdir, info):
+    from facenet_pytorch import MTCNN
+    from models import MTCNN_OPTIONS
+    from detection import detect
+    rng = np.random.default_rng(0)
+    mtcnn = MTCNN(**MTCNN_OPTIONS)
+    images = load_images(args.images) if args.images else []
+    images = images or [synthetic_image(rng) for _ in range(8)]
+    found = sum(detect(mtcnn, img)[0] is not None for img in images)
+    info['detection_hit_rate'] = found / len(images)
+    i = iter(range(10 ** 9))
+    label = 'photos' if args.images else '640x480'
+    return {f'detection.{label}': measure(lambda: detect(mtcnn, images[next(i) % len(images)]), args.repeat)}
+
+
+def bench_embedding(args, workdir, info):
+    import torch
+    resnet, info['resnet_weights'] = load_resnet(args.embed_backend)
+    results = {}
+    with torch.inference_mode():
+        for batch in (1, 16):
+            faces = torch.rand(batch, 3, 160, 160) * 2 - 1
+            results[f'embedding.{args.embed_backend}.b{batch}'] = measure(lambda: resnet(faces), args.repeat, batch)
+    return results
+
+
+def _synthetic_gallery_dir(args, workdir):
+    from gallery import EmbeddingGallery
+    rows = synthetic_gallery(args.users * args.templates)
+    gallery = EmbeddingGallery(os.path.join(workdir, 'gallery'))
+    names = [f'user{i % args.users}' for i in range(len(rows))]
+    start = time.perf_counter()
+    for s in range(0, len(rows), 5000):
+        gallery.add_many([(names[j], rows[j], None) for j in range(s, min(s + 5000, len(rows)))])
+    return gallery, rows, time.perf_counter() - start
+
+
+def bench_search(args, workdir, info):
+    from search import search_gallery, get_index, _index_cache
+    gallery, rows, _ = _synthetic_gallery_dir(args, workdir)
+    queries, _ = synthetic_queries(rows, 64)
+    results = {}
+    for storage in args.storage:
+        _index_cache.clear()
+        start = time.perf_counter()
+        get_index(gallery, 'auto', storage)
+        info[f'search_index_build_s.{storage}'] = time.perf_counter() - start
+        i = iter(range(10 ** 9))
+        results[f'search.{storage}'] = measure(
+            lambda: search_gallery(gallery, queries[next(i) % len(queries)], 1, 'auto', storage), args.repeat * 5)
+    return results
+
+
+def bench_enrolment(args, workdir, info):
+    from gallery import select_templates
+    gallery, rows, bulk_s = _synthetic_gallery_dir(args, workdir)
+    info['enrolment_bulk_per_s'] = len(rows) / bulk_s
+    rng = np.random.default_rng(1)
+    emb = rng.standard_normal(512).astype(np.float32)
+    i = iter(range(10 ** 9))
+    existing, new = rows[:3], rows[3:6]
+    return {
+        'enrolment.add_commit': measure(lambda: gallery.add(f'new{next(i)}', emb), max(5, args.repeat // 4)),
+        'enrolment.select_templates': measure(lambda: select_templates(existing, new), args.repeat),
+    }
+
+
+def bench_grading(args, workdir, info):
+    from question_bank import QuestionBank, paper_seed
+    from grading import grade_paper, ResponseMatrix, grade_cohort, item_analysis
+    from exam_sessions import ExamSession
+    bank = QuestionBank(synthetic_questions(args.questions))
+    rng = np.random.default_rng(2)
+    sessions = []
+    for c in range(args.candidates):
+        paper = bank.paper(paper_seed(f'cand{c}'), size=min(60, len(bank)))
+        answers = {int(q): int(rng.integers(0, 4)) for q in paper.ids if rng.random() < 0.9}
+        sessions.append((paper, ExamSession(f'cand{c}', 0, 0, answers=answers, submitted=1, paper=paper.ids.tolist())))
+    i = iter(range(10 ** 9))
+
+    def grade_one():
+        paper, session = sessions[next(i) % len(sessions)]
+        grade_paper(paper, session.answers)
+
+    matrix = ResponseMatrix.from_sessions([s for _, s in sessions], bank)
+    return {
+        'grading.paper': measure(grade_one, args.repeat * 5),
+        'grading.build_matrix': measure(lambda: ResponseMatrix.from_sessions([s for _, s in sessions], bank),
+                                        max(3, args.repeat // 4), len(sessions)),
+        'grading.cohort': measure(lambda: grade_cohort(matrix, bank), args.repeat, len(sessions)),
+        'grading.item_analysis': measure(lambda: item_analysis(matrix, bank), args.repeat, len(sessions)),
+    }
+
+
+def bench_results(args, workdir, info):
+    from event_store import EventStore
+    runs = iter(range(10 ** 9))
+
+    def import_legacy():
+        folder = os.path.join(workdir, f'events{next(runs)}')
+        os.makedirs(folder)
+        write_legacy_logs(folder, args.results, args.users)
+        start = time.perf_counter()
+        store = EventStore(os.path.join(folder, 'events.db'))
+        elapsed = time.perf_counter() - start
+        return store, elapsed
+
+    imports = [import_legacy() for _ in range(3)]
+    for store, _ in imports[1:]:
+        store.close()
+    store = imports[0][0]
+    times = np.array([t for _, t in imports])
+    results = {'results.import_legacy': {
+        'runs': len(times), 'items': 2 * args.results, 'mean_ms': float(times.mean() * 1000),
+        'p50_ms': float(np.median(times) * 1000), 'p95_ms': float(times.max() * 1000),
+        'p99_ms': float(times.max() * 1000), 'per_s': float(2 * args.results / times.mean())}}
+    i = iter(range(10 ** 9))
+
+    def log_batch():
+        for _ in range(1000):
+            store.log_auth(f'user{next(i) % args.users}', 'SUCCESS', 'bench')
+        store.flush()
+
+    results.update({
+        'results.latest_page': measure(lambda: store.results(limit=200), args.repeat, 200),
+        'results.one_user': measure(lambda: store.results(f'user{next(i) % args.users}'), args.repeat),
+        'results.count': measure(store.results_count, args.repeat),
+        'results.scan_all': measure(lambda: sum(1 for _ in store.iter_results()), max(3, args.repeat // 4),
+                                    args.results),
+        'results.log_auth_1000': measure(log_batch, max(3, args.repeat // 4), 1000),
+    })
+    store.close()
+    return results
+
+
+BENCHMARKS = {'detection': bench_detection, 'embedding': bench_embedding, 'search': bench_search,
+              'enrolment': bench_enrolment, 'grading': bench_grading, 'results': bench_results}
+
+
+# --- Reporting ---
+def environment():
+    def version(module):
+        try:
+            return __import__(module).__version__
+        except Exception:
+            return None
+    try:
+        git = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(RESULTS_DIR), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        git = None
+    return {'git': git, 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpu_count': os.cpu_count(), 'numpy': np.__version__, 'torch': version('torch'),
+            'facenet_pytorch': version('facenet_pytorch')}
+
+
+def print_results(results):
+    print(f'{"case":<34}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"items/s":>12}')
+    for name, r in results.items():
+        print(f'{name:<34}{r["p50_ms"]:>10.3f}{r["p95_ms"]:>10.3f}{r["p99_ms"]:>10.3f}{r["per_s"]:>12.1f}')
+
+
+def compare(results, baseline, threshold):
+    # Cases whose median latency grew by more than threshold (a fraction)
+    print(f'\nAgainst {baseline.get("label")} ({baseline.get("environment", {}).get("git")}):')
+    print(f'{"case":<34}{"base p50":>10}{"p50":>10}{"change":>9}')
+    regressions = []
+    for name, r in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        change = r['p50_ms'] / base['p50_ms'] - 1 if base['p50_ms'] else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f'{name:<34}{base["p50_ms"]:>10.3f}{r["p50_ms"]:>10.3f}{change * 100:>8.1f}%{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark suite')
+    parser.add_argument('--only', default=','.join(CASES), help=f'Comma-separated cases from {",".join(CASES)}')
+    parser.add_argument('--repeat', type=int, default=40, help='Timed runs per case')
+    parser.add_argument('--images', help='Folder of real photos to time detection on (e.g. users)')
+    parser.add_argument('--users', type=int, default=10000, help='Synthetic gallery identities')
+    parser.add_argument('--templates', type=int, default=2, help='Embeddings per identity')
+    parser.add_argument('--storage', nargs='+', default=['float32', 'int8'], help='Search storages to time')
+    parser.add_argument('--embed-backend', default='eager', help='Embedding backend (see model_backends.py)')
+    parser.add_argument('--questions', type=int, default=2000, help='Question bank size')
+    parser.add_argument('--candidates', type=int, default=500, help='Cohort size for grading')
+    parser.add_argument('--results', type=int, default=50000, help='Legacy result and auth log lines')
+    parser.add_argument('--threads', type=int, default=0, help='torch threads (default: torch default)')
+    parser.add_argument('--label', default=None, help='Name of the results file (default: git revision)')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Median slowdown flagged as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 on a regression')
+    args = parser.parse_args()
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+
+    env = environment()
+    label = args.label or env['git'] or datetime.now().strftime('%Y%m%d-%H%M%S')
+    results, info = {}, {}
+    workdir = tempfile.mkdtemp(prefix='cbt-bench-')
+    try:
+        for case in args.only.split(','):
+            start = time.perf_counter()
+            case_dir = os.path.join(workdir, case)
+            os.makedirs(case_dir)
+            results.update(BENCHMARKS[case](args, case_dir, info))
+            print(f'{case} done in {time.perf_counter() - start:.1f}s')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print()
+    print_results(results)
+    if info:
+        print('\n' + ', '.join(f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}' for k, v in info.items()))
+
+    if not os.path.exists(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+    path = os.path.join(RESULTS_DIR, f'{label}.json')
+    with open(path, 'w') as f:
+        json.dump({'label': label, 'created': datetime.now().isoformat(), 'environment': env,
+                   'params': vars(args), 'info': info, 'results': results}, f, indent=2)
+    print(f'\nSaved {path}')
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+# Threaded capture -> inference -> display pipeline for main.py
+#
+# A capture thread keeps only the newest camera frame (older unread frames are
+# dropped), an inference thread runs the RealtimeAuthenticator on the newest frame it
+# has not seen yet, and the display loop in main.py shows every captured frame with
+# the latest result drawn on top, so the preview never freezes behind inference.
+# Audio feedback goes through Beeper, which never blocks and is a no-op when sound is
+# disabled or unavailable.
+
+import os
+import sys
+import time
+import queue
+import threading
+from collections import deque
+import numpy as np
+import cv2
+from metrics import AUTH_STAGE_SECONDS, profile
+
+try:
+    import winsound
+except ImportError:
+    winsound = None
+
+SOUND_ENABLED = os.environ.get('CBT_SOUND', '1') != '0'
+STATS_WINDOW = 300
+
+
+class LatestSlot:
+    # Bounded (size 1) hand-off between threads; a new put replaces an unread value
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._value = None
+        self._read_seq = 0
+        self.dropped = 0
+
+    def put(self, value):
+        with self._cond:
+            if self._seq > self._read_seq:
+                self.dropped += 1
+            self._seq += 1
+            self._value = value
+            self._cond.notify_all()
+
+    def get(self, after=0, timeout=None, consume=True):
+        # Wait for a value newer than `after`; returns (seq, value) or (after, None) on timeout.
+        # Only consuming reads count towards `dropped` (the display loop just looks).
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > after, timeout):
+                return after, None
+            if consume:
+                self._read_seq = max(self._read_seq, self._seq)
+            return self._seq, self._value
+
+    def peek(self):
+        with self._cond:
+            return self._seq, self._value
+
+
+class StageStats:
+    def __init__(self, window=STATS_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def summary(self):
+        with self._lock:
+            samples = np.array(self._samples) * 1000.0
+        if not len(samples):
+            return {'count': self.count}
+        return {
+            'count': self.count,
+            'mean_ms': float(samples.mean()),
+            'p50_ms': float(np.percentile(samples, 50)),
+            'p95_ms': float(np.percentile(samples, 95)),
+            'max_ms': float(samples.max()),
+        }
+
+
+class Beeper:
+    def __init__(self, enabled=SOUND_ENABLED):
+        self.enabled = enabled
+        self._queue = queue.Queue(maxsize=4)
+        self._thread = None
+
+    def beep(self, frequency, duration_ms):
+        if not self.enabled:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='beeper', daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait((frequency, duration_ms))
+        except queue.Full:
+            pass  # feedback is best effort; never stall the camera loop
+
+    def _run(self):
+        while True:
+            frequency, duration_ms = self._queue.get()
+            if winsound is not None:
+                winsound.Beep(frequency, duration_ms)
+            else:
+                sys.stdout.write('\a')
+                sys.stdout.flush()
+                time.sleep(duration_ms / 1000.0)
+
+
+class CameraPipeline:
+    def __init__(self, authenticator, source=0):
+        self.authenticator = authenticator
+        self.source = source
+        self.frames = LatestSlot()
+        self.results = LatestSlot()
+        # Identity decisions must not be dropped like frames, so they get their own queue
+        self.events = queue.Queue(maxsize=256)
+        self.capture_stats = StageStats()
+        self.inference_stats = StageStats()
+        self.display_stats = StageStats()
+        self.failed = False
+        self._running = threading.Event()
+        self._threads = []
+        self._cap = None
+
+    def start(self):
+        self._cap = cv2.VideoCapture(self.source)
+        self.failed = False
+        self._running.set()
+        self._threads = [
+            threading.Thread(target=self._capture_loop, name='camera-capture', daemon=True),
+            threading.Thread(target=self._inference_loop, name='camera-inference', daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+        return self
+
+    def stop(self):
+        self._running.clear()
+        for t in self._threads:
+            t.join(timeout=2.0)
+        self._threads = []
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+    def _capture_loop(self):
+        last = time.perf_counter()
+        while self._running.is_set():
+            ret, frame = self._cap.read()
+            if not ret:
+                self.failed = True
+                self.frames.put(None)
+                return
+            now = time.perf_counter()
+            self.capture_stats.record(now - last)
+            last = now
+            self.frames.put(frame)
+
+    def _inference_loop(self):
+        seen = 0
+        while self._running.is_set():
+            seq, frame = self.frames.get(after=seen, timeout=0.1)
+            seen = seq
+            if frame is None:
+                continue
+            start = time.perf_counter()
+            with profile('camera_frame'):
+                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                result = self.authenticator.process(rgb)
+            elapsed = time.perf_counter() - start
+            self.inference_stats.record(elapsed)
+            AUTH_STAGE_SECONDS.observe(elapsed, source='camera', stage='frame')
+            self.results.put(result)
+            if result['new_decision']:
+                try:
+                    self.events.put_nowait(result)
+                except queue.Full:
+                    pass
+
+    def poll_events(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def stats(self):
+        return {
+            'capture_interval': self.capture_stats.summary(),
+            'inference': self.inference_stats.summary(),
+            'display': self.display_stats.summary(),
+            'frames_dropped_before_inference': self.frames.dropped,
+            'results_dropped_before_display': self.results.dropped,
+        }
@@ -0,0 +1,51 @@
+# Face detection on a downscaled copy, cropping from the full-resolution image
+#
+# MTCNN's cost grows with the number of pixels, but it only needs a face to be
+# min_face_size pixels wide to find it. We choose the smallest scale at which a face
+# covering MIN_FACE_FRACTION of the image's shorter side is still min_face_size
+# pixels, run detection there, map the boxes back, and cut the 160x160 crop from the
+# original image so the embedding sees full detail.
+
+import os
+import cv2
+import numpy as np
+
+MIN_FACE_FRACTION = float(os.environ.get('CBT_MIN_FACE_FRACTION', 0.1))
+
+
+def detection_scale(shape, min_face_size, min_face_fraction=MIN_FACE_FRACTION):
+    # 1.0 means detect at full resolution; min_face_fraction <= 0 disables downscaling
+    if min_face_fraction <= 0:
+        return 1.0
+    smallest_face = min_face_fraction * min(shape[0], shape[1])
+    return min(1.0, min_face_size / smallest_face) if smallest_face > 0 else 1.0
+
+
+def downscale(rgb, scale):
+    if scale >= 1.0:
+        return rgb
+    h, w = rgb.shape[:2]
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    return cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+
+
+def detect(mtcnn, rgb, min_face_fraction=MIN_FACE_FRACTION):
+    # Boxes (largest first) and probabilities in original-image coordinates, or (None, None)
+    scale = detection_scale(rgb.shape, mtcnn.min_face_size, min_face_fraction)
+    boxes, probs = mtcnn.detect(downscale(rgb, scale))
+    if boxes is None:
+        return None, None
+    return np.asarray(boxes, dtype=np.float32) / scale, probs
+
+
+def crop(mtcnn, rgb, boxes):
+    # Aligned crop of the first box, taken from the full-resolution image
+    return mtcnn.extract(rgb, np.asarray(boxes[:1]), None)
+
+
+def detect_face(mtcnn, rgb, min_face_fraction=MIN_FACE_FRACTION):
+    # Drop-in for mtcnn(rgb): a (3, 160, 160) face tensor or None
+    boxes, _ = detect(mtcnn, rgb, min_face_fraction)
+    if boxes is None:
+        return None
+    return crop(mtcnn, rgb, boxes)
@@ -0,0 +1,130 @@
+# Micro-batching embedding service
+#
+# Callers (Flask requests, Streamlit sessions, bulk enrolment) submit aligned 160x160
+# face crops from their own threads. A single worker thread gathers whatever arrives
+# within EMBED_MAX_WAIT_MS (up to EMBED_BATCH_SIZE crops), runs one InceptionResnetV1
+# forward pass under torch.inference_mode() and hands each caller its own row.
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import numpy as np
+import torch
+
+EMBED_BATCH_SIZE = int(os.environ.get('CBT_EMBED_BATCH', 16))
+EMBED_MAX_WAIT_MS = float(os.environ.get('CBT_EMBED_WAIT_MS', 5))
+
+
+class EmbeddingService:
+    def __init__(self, resnet, max_batch_size=EMBED_BATCH_SIZE, max_wait_ms=EMBED_MAX_WAIT_MS):
+        self.resnet = resnet
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'batches': 0, 'items': 0, 'busy_s': 0.0, 'wait_s': 0.0, 'max_batch': 0}
+        self._started_at = time.perf_counter()
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='embedding-service', daemon=True)
+                    self._thread.start()
+
+    # --- Client API ---
+    def submit(self, face):
+        # face: (3, 160, 160) tensor as returned by mtcnn(); resolves to a (512,) float32 array
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((face, future, time.perf_counter()))
+        return future
+
+    def embed(self, face, timeout=None):
+        return self.submit(face).result(timeout)[None, :]
+
+    def embed_many(self, faces, timeout=None):
+        futures = [self.submit(face) for face in faces]
+        if not futures:
+            return np.zeros((0, 512), dtype=np.float32)
+        return np.vstack([f.result(timeout) for f in futures])
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    # --- Worker ---
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            start = time.perf_counter()
+            try:
+                faces = torch.stack([face for face, _, _ in batch])
+                with torch.inference_mode():
+                    embeddings = self.resnet(faces).numpy().astype(np.float32)
+            except Exception as exc:
+                for _, future, _ in batch:
+                    future.set_exception(exc)
+                continue
+            for i, (_, future, _) in enumerate(batch):
+                future.set_result(embeddings[i])
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                self._stats['batches'] += 1
+                self._stats['items'] += len(batch)
+                self._stats['busy_s'] += elapsed
+                self._stats['wait_s'] += sum(start - queued for _, _, queued in batch)
+                self._stats['max_batch'] = max(self._stats['max_batch'], len(batch))
+
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        s['max_batch_size'] = self.max_batch_size
+        s['max_wait_ms'] = self.max_wait * 1000.0
+        s['mean_batch'] = s['items'] / s['batches'] if s['batches'] else 0.0
+        s['mean_queue_wait_ms'] = 1000.0 * s['wait_s'] / s['items'] if s['items'] else 0.0
+        s['throughput_per_s'] = s['items'] / s['busy_s'] if s['busy_s'] else 0.0
+        s['uptime_s'] = time.perf_counter() - self._started_at
+        return s
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_service(resnet=None):
+    # Shared per process; defaults to the registry's InceptionResnetV1
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                if resnet is None:
+                    from models import get_models
+                    resnet = get_models()[1]
+                _service = EmbeddingService(resnet)
+    return _service
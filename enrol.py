@@ -0,0 +1,215 @@
+# Bulk enrolment of a class roster from a folder or zip of ID photos
+# Usage: python enrol.py roster.zip [--batch 32] [--workers 4] [--report enrol_report.csv]
+#
+# Each photo's file name (without extension) becomes the username, as with users/.
+# Images are read and decoded by a worker pool, MTCNN runs on batches of equally
+# sized downscaled copies, InceptionResnetV1 runs through the micro-batching
+# embedding service, and every batch is written to users/ and the gallery in one commit. Progress is
+# appended to a state file after each batch, so re-running the same command after
+# an interruption skips photos that were already handled.
+
+import os
+import csv
+import json
+import time
+import zipfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+
+from gallery import get_gallery, IMAGE_EXTENSIONS, USER_FOLDER
+from models import get_models
+from embedding_service import EmbeddingService
+from detection import detection_scale, downscale
+
+STATE_FILE = 'enrol_state.jsonl'
+REPORT_FILE = 'enrol_report.csv'
+MIN_FACE_PROB = 0.9
+
+
+# --- Sources ---
+def iter_sources(source):
+    # Yields (key, name, ext, loader); the key identifies one version of one photo
+    if zipfile.is_zipfile(source):
+        zf = zipfile.ZipFile(source)
+        for info in zf.infolist():
+            name, ext = os.path.splitext(os.path.basename(info.filename))
+            if info.is_dir() or ext.lower() not in IMAGE_EXTENSIONS:
+                continue
+            yield f'{info.filename}:{info.CRC}', name, ext.lower(), (lambda info=info: zf.read(info))
+        return
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for fname in sorted(files):
+            name, ext = os.path.splitext(fname)
+            if ext.lower() not in IMAGE_EXTENSIONS:
+                continue
+            path = os.path.join(root, fname)
+            st = os.stat(path)
+            key = f'{os.path.relpath(path, source)}:{st.st_size}:{st.st_mtime_ns}'
+            yield key, name, ext.lower(), (lambda path=path: open(path, 'rb').read())
+
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def decode(source_item, zip_data=None):
+    key, name, ext, loader = source_item
+    try:
+        data = zip_data if zip_data is not None else loader()
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    except Exception:
+        return source_item, None, None
+    if img is None:
+        return source_item, None, None
+    return source_item, data, cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+# --- Detection ---
+def detect_batch(mtcnn, images):
+    # Detect on downscaled copies; MTCNN only batches images of identical shape, so
+    # bucket the downscaled copies by shape. Boxes come back in original coordinates.
+    boxes = [None] * len(images)
+    probs = [None] * len(images)
+    scales = [detection_scale(img.shape, mtcnn.min_face_size) for img in images]
+    small = [downscale(img, s) for img, s in zip(images, scales)]
+    buckets = {}
+    for i, img in enumerate(small):
+        buckets.setdefault(img.shape, []).append(i)
+    for idx in buckets.values():
+        batch = [small[i] for i in idx]
+        batch_boxes, batch_probs = mtcnn.detect(batch if len(batch) > 1 else batch[0])
+        if len(batch) == 1:
+            batch_boxes, batch_probs = [batch_boxes], [batch_probs]
+        for i, b, p in zip(idx, batch_boxes, batch_probs):
+            if b is None:
+                continue
+            keep = np.array([x is not None and x >= MIN_FACE_PROB for x in p], dtype=bool)
+            if keep.any():
+                boxes[i] = np.asarray(b, dtype=np.float32)[keep] / scales[i]
+                probs[i] = np.asarray(p)[keep]
+    return boxes, probs
+
+
+# --- Resumable state ---
+def load_state(state_path):
+    done = {}
+    if os.path.exists(state_path):
+        with open(state_path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from an interrupted run
+                done[record['key']] = record
+    return done
+
+
+def write_report(report_path, records):
+    problems = [r for r in records if r['status'] != 'enrolled']
+    with open(report_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['source', 'name', 'status', 'faces'])
+        writer.writeheader()
+        for r in problems:
+            writer.writerow({k: r.get(k) for k in ('source', 'name', 'status', 'faces')})
+    return problems
+
+
+def enrol(source, batch_size=32, workers=4, state_path=None, report_path=REPORT_FILE, allow_multiple=False):
+    # Photos are copied into USER_FOLDER, the folder app.py, app_streamlit.py and main.py
+    # sync the gallery against; enrolled anywhere else they would be dropped at startup
+    gallery = get_gallery()
+    mtcnn, resnet = get_models()
+    embedder = EmbeddingService(resnet, max_batch_size=batch_size)
+    state_path = state_path or os.path.join(gallery.gallery_dir, STATE_FILE)
+    done = load_state(state_path)
+    if not os.path.exists(USER_FOLDER):
+        os.makedirs(USER_FOLDER)
+    is_zip = zipfile.is_zipfile(source)
+    pending = (s for s in iter_sources(source) if s[0] not in done)
+    counts = {}
+    processed = 0
+    start = time.perf_counter()
+
+    def submit(pool, chunk):
+        # Zip members are read sequentially here; decoding still happens in the pool
+        if is_zip:
+            return [pool.submit(decode, item, item[3]()) for item in chunk]
+        return [pool.submit(decode, item) for item in chunk]
+
+    with ThreadPoolExecutor(workers) as pool, open(state_path, 'a') as state:
+        chunks = chunked(pending, batch_size)
+        inflight = submit(pool, next(chunks, []))
+        while inflight:
+            decoded = [f.result() for f in inflight]
+            # Start decoding the next chunk while this one runs through the models
+            inflight = submit(pool, next(chunks, []))
+            records = []
+            ok = []
+            for item, data, rgb in decoded:
+                record = {'key': item[0], 'source': item[0].split(':')[0], 'name': item[1], 'faces': 0}
+                if rgb is None:
+                    record['status'] = 'unreadable'
+                else:
+                    ok.append((item, data, rgb, record))
+                records.append(record)
+            if ok:
+                boxes, _ = detect_batch(mtcnn, [rgb for _, _, rgb, _ in ok])
+                to_embed = []
+                for (item, data, rgb, record), b in zip(ok, boxes):
+                    record['faces'] = 0 if b is None else len(b)
+                    if b is None:
+                        record['status'] = 'no_face'
+                    elif len(b) > 1 and not allow_multiple:
+                        record['status'] = 'multiple_faces'
+                    else:
+                        to_embed.append((item, data, rgb, record, b[:1]))
+                if to_embed:
+                    faces = mtcnn.extract([e[2] for e in to_embed], [e[4] for e in to_embed], None)
+                    embs = embedder.embed_many(faces)
+                    items = []
+                    for (item, data, _, record, _), emb in zip(to_embed, embs):
+                        save_path = os.path.join(USER_FOLDER, item[1] + item[2])
+                        with open(save_path, 'wb') as f:
+                            f.write(data)
+                        items.append((item[1], emb, save_path))
+                        record['status'] = 'enrolled'
+                    gallery.add_many(items)
+            for record in records:
+                state.write(json.dumps(record) + '\n')
+                counts[record['status']] = counts.get(record['status'], 0) + 1
+                done[record['key']] = record
+            state.flush()
+            processed += len(records)
+            elapsed = time.perf_counter() - start
+            print(f'{processed} photos processed ({processed / elapsed:.1f}/s): ' +
+                  ', '.join(f'{k}={v}' for k, v in sorted(counts.items())))
+    embedder.close()
+    problems = write_report(report_path, done.values())
+    print(f'Done. {len(problems)} photo(s) need attention, see {report_path}')
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk-enrol students from a folder or zip of ID photos')
+    parser.add_argument('source', help='Directory or .zip of photos named <username>.jpg/.jpeg/.png')
+    parser.add_argument('--batch', type=int, default=32, help='Photos per detection/embedding batch')
+    parser.add_argument('--workers', type=int, default=4, help='Image read/decode threads')
+    parser.add_argument('--state', default=None, help=f'Progress file (default: gallery/{STATE_FILE})')
+    parser.add_argument('--report', default=REPORT_FILE, help='CSV of photos with no or multiple faces')
+    parser.add_argument('--allow-multiple', action='store_true', help='Enrol the largest face when several are found')
+    args = parser.parse_args()
+    enrol(args.source, args.batch, args.workers, args.state, args.report, args.allow_multiple)
+
+
+if __name__ == '__main__':
+    main()
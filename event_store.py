@@ -0,0 +1,264 @@
+# Append-only store for authentication attempts and exam results
+#
+# Replaces auth_log.txt and cbt_results.txt with a SQLite database in WAL mode, so
+# app_streamlit.py and main.py can write while the admin dashboard reads. Both tables
+# are indexed on (username, ts) and ts, which keeps "latest N", "everything for one
+# user" and per-status counts independent of how much history has piled up.
+#
+# Authentication events are buffered and written in batches by a background thread
+# (every FLUSH_INTERVAL seconds or BATCH_SIZE events); exam results are committed
+# immediately since losing one is not acceptable. Reads flush the buffer first so a
+# process always sees its own writes. The legacy text files are imported once, the
+# first time the database is created next to them.
+
+import os
+import time
+import atexit
+import sqlite3
+import threading
+from datetime import datetime
+
+EVENTS_DB = os.environ.get('CBT_EVENTS_DB', 'events.db')
+LEGACY_AUTH_LOG = 'auth_log.txt'
+LEGACY_RESULTS = 'cbt_results.txt'
+FLUSH_INTERVAL = 0.5
+BATCH_SIZE = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS auth_events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    username TEXT NOT NULL,
+    status TEXT NOT NULL,
+    source TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS auth_events_user_ts ON auth_events (username, ts);
+CREATE INDEX IF NOT EXISTS auth_events_ts ON auth_events (ts);
+CREATE INDEX IF NOT EXISTS auth_events_status ON auth_events (status);
+CREATE TABLE IF NOT EXISTS exam_results (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    username TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    total INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS exam_results_user_ts ON exam_results (username, ts);
+CREATE INDEX IF NOT EXISTS exam_results_ts ON exam_results (ts);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _parse_legacy_line(line):
+    # '2025-06-10 19:07:50.850492 - user - STATUS' -> (epoch seconds, user, STATUS)
+    parts = line.strip().split(' - ')
+    if len(parts) < 3:
+        return None
+    try:
+        ts = datetime.fromisoformat(parts[0].strip()).timestamp()
+    except ValueError:
+        return None
+    return ts, ' - '.join(parts[1:-1]).strip(), parts[-1].strip()
+
+
+class EventStore:
+    def __init__(self, path=EVENTS_DB, flush_interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._lock = threading.RLock()
+        self._pending = []
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+        self._import_legacy()
+        self._writer = threading.Thread(target=self._write_loop, name='event-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _import_legacy(self):
+        folder = os.path.dirname(os.path.abspath(self.path))
+        with self._lock, self._conn:
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+                return
+            auth_path = os.path.join(folder, LEGACY_AUTH_LOG)
+            if os.path.exists(auth_path):
+                with open(auth_path, 'r') as f:
+                    rows = [r for r in map(_parse_legacy_line, f) if r]
+                self._conn.executemany(
+                    "INSERT INTO auth_events (ts, username, status, source) VALUES (?, ?, ?, 'legacy')", rows)
+            results_path = os.path.join(folder, LEGACY_RESULTS)
+            if os.path.exists(results_path):
+                rows = []
+                with open(results_path, 'r') as f:
+                    for parsed in map(_parse_legacy_line, f):
+                        if not parsed or not parsed[2].startswith('Score:'):
+                            continue
+                        try:
+                            score, total = parsed[2].split(':', 1)[1].strip().split('/')
+                            rows.append((parsed[0], parsed[1], int(score), int(total)))
+                        except ValueError:
+                            continue
+                self._conn.executemany(
+                    'INSERT INTO exam_results (ts, username, score, total) VALUES (?, ?, ?, ?)', rows)
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_imported', ?)",
+                               (datetime.now().isoformat(),))
+
+    # --- Writes ---
+    def log_auth(self, username, status, source='', ts=None):
+        with self._lock:
+            self._pending.append((ts or time.time(), username, status, source))
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+
+    def record_result(self, username, score, total, ts=None):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT INTO exam_results (ts, username, score, total) VALUES (?, ?, ?, ?)',
+                               (ts or time.time(), username, int(score), int(total)))
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        'INSERT INTO auth_events (ts, username, status, source) VALUES (?, ?, ?, ?)', batch)
+            except sqlite3.Error:
+                # Rolled back; keep the batch ahead of anything logged since and let the caller retry
+                self._pending[:0] = batch
+                raise
+
+    def _write_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                # Keep the events and retry on the next tick (e.g. the database was locked)
+                print(f'Event store flush failed: {e}')
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._writer.join(timeout=5)
+        with self._lock:
+            try:
+                self.flush()
+            finally:
+                self._conn.close()
+
+    # --- Queries ---
+    def _query(self, sql, params=()):
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            # The events stay buffered for the writer thread; answer from what is committed
+            print(f'Event store flush failed: {e}')
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def recent_auth(self, limit=20, username=None):
+        # Newest last, like the tail of the old log
+        if username is None:
+            rows = self._query('SELECT id, ts, username, status, source FROM auth_events '
+                               'ORDER BY ts DESC LIMIT ?', (limit,))
+        else:
+            rows = self._query('SELECT id, ts, username, status, source FROM auth_events '
+                               'WHERE username = ? ORDER BY ts DESC LIMIT ?', (username, limit))
+        return [{'id': r[0], 'timestamp': datetime.fromtimestamp(r[1]), 'username': r[2],
+                 'status': r[3], 'source': r[4]} for r in reversed(rows)]
+
+    def auth_events_since(self, last_id=0, limit=None):
+        # (id, ts, username, status) in insertion order, for incremental consumers
+        return self._query('SELECT id, ts, username, status FROM auth_events WHERE id > ? '
+                           'ORDER BY id LIMIT ?', (last_id, -1 if limit is None else limit))
+
+    def auth_count(self):
+        return self._query('SELECT COUNT(*) FROM auth_events')[0][0]
+
+    def auth_status_counts(self):
+        return dict(self._query('SELECT status, COUNT(*) FROM auth_events GROUP BY status ORDER BY 2 DESC'))
+
+    def auth_user_counts(self):
+        return dict(self._query('SELECT username, COUNT(*) FROM auth_events GROUP BY username ORDER BY 2 DESC'))
+
+    def results(self, username=None, limit=None):
+        limit = -1 if limit is None else limit
+        if username is None:
+            rows = self._query('SELECT id, ts, username, score, total FROM exam_results '
+                               'ORDER BY ts DESC LIMIT ?', (limit,))
+        else:
+            rows = self._query('SELECT id, ts, username, score, total FROM exam_results '
+                               'WHERE username = ? ORDER BY ts DESC LIMIT ?', (username, limit))
+        return [{'id': r[0], 'timestamp': datetime.fromtimestamp(r[1]), 'username': r[2],
+                 'score': r[3], 'total': r[4]} for r in reversed(rows)]
+
+    def result_users(self):
+        return [r[0] for r in self._query('SELECT DISTINCT username FROM exam_results ORDER BY username')]
+
+    def results_count(self):
+        return self._query('SELECT COUNT(*) FROM exam_results')[0][0]
+
+    def results_version(self):
+        # Changes whenever a result is recorded or deleted
+        count, last = self._query('SELECT COUNT(*), COALESCE(MAX(id), 0) FROM exam_results')[0]
+        return f'{last}-{count}'
+
+    def auth_version(self):
+        return str(self._query('SELECT COALESCE(MAX(id), 0) FROM auth_events')[0][0])
+
+    def _iter(self, sql, batch):
+        # Streams rows on a separate connection (one consistent snapshot) without holding the lock
+        self.flush()
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        try:
+            cur = conn.execute(sql)
+            while True:
+                rows = cur.fetchmany(batch)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    def iter_auth(self, batch=1000):
+        # (timestamp, username, status) oldest first
+        for ts, username, status in self._iter('SELECT ts, username, status FROM auth_events ORDER BY ts', batch):
+            yield datetime.fromtimestamp(ts), username, status
+
+    def iter_results(self, by_user=False, batch=1000):
+        # (timestamp, username, score, total), by time or grouped by username
+        order = 'username, ts' if by_user else 'ts'
+        for ts, username, score, total in self._iter(
+                f'SELECT ts, username, score, total FROM exam_results ORDER BY {order}', batch):
+            yield datetime.fromtimestamp(ts), username, score, total
+
+    def delete_results(self, username):
+        # Exact username match; returns the number of results removed
+        with self._lock, self._conn:
+            return self._conn.execute('DELETE FROM exam_results WHERE username = ?', (username,)).rowcount
+
+
+_shared_stores = {}
+_shared_lock = threading.Lock()
+
+
+def get_event_store(path=EVENTS_DB):
+    # One store (and writer thread) per process and database file
+    with _shared_lock:
+        store = _shared_stores.get(path)
+        if store is None:
+            store = EventStore(path)
+            _shared_stores[path] = store
+        return store
@@ -0,0 +1,225 @@
+# Server-side exam sessions with debounced autosave
+#
+# A session is created when a candidate authenticates and holds their answers,
+# current question and a deadline fixed at start time from their time limit. Because
+# the deadline is stored with the session, re-authenticating after a refresh, lost
+# connection or server restart resumes the same attempt with the same clock, and
+# answers arriving after the deadline (plus GRACE_SECONDS) are refused. A candidate
+# gets one attempt: once it is submitted, authenticating again shows that attempt
+# until an admin reset discards it, so its graded answers stay available for analysis.
+#
+# Answer changes only update the in-memory session and mark it dirty; a background
+# thread writes every dirty session in one transaction each AUTOSAVE_INTERVAL seconds,
+# so hundreds of candidates clicking produce a handful of batched writes rather than
+# one write per click. Starting and submitting are written through immediately.
+
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+from event_store import EVENTS_DB
+from exam_store import add_missing_columns
+
+AUTOSAVE_INTERVAL = float(os.environ.get('CBT_AUTOSAVE_INTERVAL', 2.0))
+GRACE_SECONDS = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS exam_sessions (
+    username TEXT PRIMARY KEY,
+    started REAL NOT NULL,
+    deadline REAL NOT NULL,
+    current_q INTEGER NOT NULL DEFAULT 0,
+    answers TEXT NOT NULL DEFAULT '{}',
+    submitted REAL,
+    score INTEGER,
+    updated REAL NOT NULL,
+    paper TEXT NOT NULL DEFAULT '[]',
+    seed INTEGER NOT NULL DEFAULT 0
+);
+"""
+MIGRATIONS = [
+    ('exam_sessions', 'paper', "TEXT NOT NULL DEFAULT '[]'"),
+    ('exam_sessions', 'seed', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+
+class ExamSession:
+    def __init__(self, username, started, deadline, current_q=0, answers=None, submitted=None, score=None,
+                 paper=None, seed=0):
+        self.username = username
+        self.started = started
+        self.deadline = deadline
+        self.current_q = current_q
+        self.answers = answers or {}  # question id -> chosen option index (in the bank's option order)
+        self.submitted = submitted
+        self.score = score
+        self.paper = paper or []      # question ids in the candidate's order
+        self.seed = seed
+
+    def remaining(self, now=None):
+        return max(0.0, self.deadline - (now or time.time()))
+
+    @property
+    def expired(self):
+        return time.time() > self.deadline + GRACE_SECONDS
+
+    @property
+    def is_open(self):
+        return self.submitted is None
+
+    def _row(self):
+        return (self.username, self.started, self.deadline, self.current_q,
+                json.dumps({str(k): v for k, v in self.answers.items()}), self.submitted, self.score, time.time(),
+                json.dumps(self.paper), self.seed)
+
+
+class ExamSessionStore:
+    def __init__(self, path=EVENTS_DB, autosave_interval=AUTOSAVE_INTERVAL):
+        self.path = path
+        self.autosave_interval = autosave_interval
+        self._lock = threading.RLock()
+        self._sessions = {}
+        self._dirty = set()
+        self._closed = False
+        self._wakeup = threading.Event()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+        add_missing_columns(self._conn, MIGRATIONS)
+        self.writes = 0
+        self._writer = threading.Thread(target=self._autosave_loop, name='exam-autosave', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    COLUMNS = 'username, started, deadline, current_q, answers, submitted, score, paper, seed'
+
+    @staticmethod
+    def _from_row(row):
+        answers = {int(k): v for k, v in json.loads(row[4]).items()}
+        return ExamSession(row[0], row[1], row[2], row[3], answers, row[5], row[6], json.loads(row[7]), row[8])
+
+    def _load(self, username):
+        row = self._conn.execute(f'SELECT {self.COLUMNS} FROM exam_sessions WHERE username = ?',
+                                 (username,)).fetchone()
+        return self._from_row(row) if row else None
+
+    def _write(self, sessions):
+        with self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO exam_sessions '
+                '(username, started, deadline, current_q, answers, submitted, score, updated, paper, seed) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [s._row() for s in sessions])
+        self.writes += 1
+
+    def get(self, username):
+        with self._lock:
+            session = self._sessions.get(username)
+            if session is None:
+                session = self._load(username)
+                if session is not None:
+                    self._sessions[username] = session
+            return session
+
+    def start_or_resume(self, username, time_limit, paper=None, seed=0):
+        # Returns (session, resumed). An existing attempt is returned as it is: an open one
+        # keeps its deadline and paper, a submitted one stays closed until discard().
+        # Only a candidate without an attempt starts a fresh one on `paper`.
+        with self._lock:
+            session = self.get(username)
+            if session is not None:
+                return session, True
+            now = time.time()
+            session = ExamSession(username, now, now + time_limit, paper=list(paper or []), seed=seed)
+            self._sessions[username] = session
+            self._dirty.discard(username)
+            self._write([session])
+            return session, False
+
+    def save_answer(self, username, question_id, answer):
+        # False if the attempt is closed or past its deadline
+        with self._lock:
+            session = self.get(username)
+            if session is None or not session.is_open or session.expired:
+                return False
+            if session.answers.get(question_id) != answer:
+                session.answers[question_id] = answer
+                self._dirty.add(username)
+            return True
+
+    def set_position(self, username, q_idx):
+        with self._lock:
+            session = self.get(username)
+            if session is not None and session.is_open and session.current_q != q_idx:
+                session.current_q = q_idx
+                self._dirty.add(username)
+
+    def submit(self, username, score):
+        # True if this call closed the attempt (False if it was already submitted)
+        with self._lock:
+            session = self.get(username)
+            if session is None or not session.is_open:
+                return False
+            session.submitted = time.time()
+            session.score = score
+            self._dirty.discard(username)
+            self._write([session])
+            return True
+
+    def submitted_sessions(self):
+        # The submitted attempt of every candidate, for cohort grading
+        with self._lock:
+            self.flush()
+            rows = self._conn.execute(f'SELECT {self.COLUMNS} FROM exam_sessions '
+                                      'WHERE submitted IS NOT NULL ORDER BY username').fetchall()
+        return [self._from_row(r) for r in rows]
+
+    def discard(self, username):
+        # Used by the admin reset so the candidate starts over with a fresh clock
+        with self._lock, self._conn:
+            self._sessions.pop(username, None)
+            self._dirty.discard(username)
+            self._conn.execute('DELETE FROM exam_sessions WHERE username = ?', (username,))
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return 0
+            sessions = [self._sessions[u] for u in self._dirty if u in self._sessions]
+            self._write(sessions)  # on failure the sessions stay dirty for the next tick
+            self._dirty.clear()
+            return len(sessions)
+
+    def _autosave_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.autosave_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f'Exam autosave failed: {e}')
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._writer.join(timeout=5)
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+
+_shared_stores = {}
+_shared_lock = threading.Lock()
+
+
+def get_session_store(path=EVENTS_DB):
+    with _shared_lock:
+        store = _shared_stores.get(path)
+        if store is None:
+            store = ExamSessionStore(path)
+            _shared_stores[path] = store
+        return store
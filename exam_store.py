@@ -0,0 +1,179 @@
+# Transactional storage for exam configuration: per-user time limits and questions
+#
+# Replaces the read-whole-file / rewrite-whole-file handling of user_time_limits.json
+# and cbt_questions.json, which lost updates when two admins saved at once. Both live
+# in SQLite tables (in the same WAL-mode database as event_store.py) keyed by username
+# and question id, so every change is a single-row transaction. Questions are edited
+# and deleted by id rather than list position, so an edit never lands on a question
+# another admin has just moved. The JSON files are imported once when the tables are
+# first created.
+
+import os
+import json
+import sqlite3
+import threading
+from event_store import EVENTS_DB
+
+LEGACY_TIME_LIMITS = 'user_time_limits.json'
+LEGACY_QUESTIONS = 'cbt_questions.json'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS time_limits (
+    username TEXT PRIMARY KEY,
+    seconds INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    options TEXT NOT NULL,
+    answer INTEGER NOT NULL,
+    course TEXT NOT NULL DEFAULT '',
+    section TEXT NOT NULL DEFAULT '',
+    difficulty TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS questions_position ON questions (position);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+# Columns added after the first release of each table: (table, column, definition)
+MIGRATIONS = [
+    ('questions', 'course', "TEXT NOT NULL DEFAULT ''"),
+    ('questions', 'section', "TEXT NOT NULL DEFAULT ''"),
+    ('questions', 'difficulty', "TEXT NOT NULL DEFAULT ''"),
+]
+
+
+def add_missing_columns(conn, migrations):
+    with conn:
+        for table, column, definition in migrations:
+            columns = [r[1] for r in conn.execute(f'PRAGMA table_info({table})')]
+            if column not in columns:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+class ExamStore:
+    def __init__(self, path=EVENTS_DB):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+        add_missing_columns(self._conn, MIGRATIONS)
+        self._import_legacy()
+
+    def _import_legacy(self):
+        folder = os.path.dirname(os.path.abspath(self.path))
+        with self._lock, self._conn:
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_exam_imported'").fetchone():
+                return
+            limits_path = os.path.join(folder, LEGACY_TIME_LIMITS)
+            if os.path.exists(limits_path):
+                with open(limits_path, 'r') as f:
+                    limits = json.load(f)
+                self._conn.executemany('INSERT OR REPLACE INTO time_limits (username, seconds) VALUES (?, ?)',
+                                       [(u, int(s)) for u, s in limits.items()])
+            questions_path = os.path.join(folder, LEGACY_QUESTIONS)
+            if os.path.exists(questions_path):
+                with open(questions_path, 'r') as f:
+                    questions = json.load(f)
+                self._conn.executemany(
+                    'INSERT INTO questions (position, question, options, answer, course, section, difficulty) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(i, q['question'], json.dumps(q['options']), int(q['answer']), q.get('course', ''),
+                      q.get('section', ''), q.get('difficulty', '')) for i, q in enumerate(questions)])
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_exam_imported', '1')")
+
+    def _execute(self, sql, params=()):
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params)
+
+    def _bump_questions_version(self):
+        self._conn.execute("INSERT INTO meta (key, value) VALUES ('questions_version', '1') "
+                           "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+
+    # --- Time limits ---
+    def get_time_limit(self, username, default=None):
+        with self._lock:
+            row = self._conn.execute('SELECT seconds FROM time_limits WHERE username = ?', (username,)).fetchone()
+        return row[0] if row else default
+
+    def set_time_limit(self, username, seconds):
+        self._execute('INSERT INTO time_limits (username, seconds) VALUES (?, ?) '
+                      'ON CONFLICT (username) DO UPDATE SET seconds = excluded.seconds', (username, int(seconds)))
+
+    def time_limits(self, usernames=None):
+        # {username: seconds}, for every user or only the given ones (e.g. one admin page)
+        with self._lock:
+            if usernames is None:
+                return dict(self._conn.execute('SELECT username, seconds FROM time_limits'))
+            usernames = list(usernames)
+            limits = {}
+            for i in range(0, len(usernames), 500):  # below SQLite's bound-parameter limit
+                chunk = usernames[i:i + 500]
+                limits.update(self._conn.execute('SELECT username, seconds FROM time_limits WHERE username IN '
+                                                 f'({",".join("?" * len(chunk))})', chunk))
+            return limits
+
+    # --- Questions ---
+    def questions_version(self):
+        # Changes whenever any process edits the questions
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'questions_version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def list_questions(self, course=None):
+        sql = 'SELECT id, question, options, answer, course, section, difficulty FROM questions'
+        params = ()
+        if course is not None:
+            sql, params = sql + ' WHERE course = ?', (course,)
+        with self._lock:
+            rows = self._conn.execute(sql + ' ORDER BY position, id', params).fetchall()
+        return [{'id': r[0], 'question': r[1], 'options': json.loads(r[2]), 'answer': r[3],
+                 'course': r[4], 'section': r[5], 'difficulty': r[6]} for r in rows]
+
+    def courses(self):
+        with self._lock:
+            return [r[0] for r in self._conn.execute('SELECT DISTINCT course FROM questions ORDER BY course')]
+
+    def add_question(self, question, options, answer, course='', section='', difficulty=''):
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                'INSERT INTO questions (position, question, options, answer, course, section, difficulty) '
+                'SELECT COALESCE(MAX(position), -1) + 1, ?, ?, ?, ?, ?, ? FROM questions',
+                (question, json.dumps(options), int(answer), course, section, difficulty))
+            self._bump_questions_version()
+            return cur.lastrowid
+
+    def update_question(self, question_id, question, options, answer, course='', section='', difficulty=''):
+        # False if the question was deleted in the meantime
+        with self._lock, self._conn:
+            cur = self._conn.execute('UPDATE questions SET question = ?, options = ?, answer = ?, course = ?, '
+                                     'section = ?, difficulty = ? WHERE id = ?',
+                                     (question, json.dumps(options), int(answer), course, section, difficulty,
+                                      question_id))
+            self._bump_questions_version()
+            return cur.rowcount > 0
+
+    def delete_question(self, question_id):
+        with self._lock, self._conn:
+            cur = self._conn.execute('DELETE FROM questions WHERE id = ?', (question_id,))
+            self._bump_questions_version()
+            return cur.rowcount > 0
+
+
+_shared_stores = {}
+_shared_lock = threading.Lock()
+
+
+def get_exam_store(path=EVENTS_DB):
+    with _shared_lock:
+        store = _shared_stores.get(path)
+        if store is None:
+            store = ExamStore(path)
+            _shared_stores[path] = store
+        return store
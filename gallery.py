@@ -0,0 +1,589 @@
+# Persistent face embedding gallery shared by app.py, app_streamlit.py and main.py
+#
+# Embeddings live in GALLERY_DIR as a raw float32 matrix (embeddings.f32, opened
+# with np.memmap) plus a JSON index with one entry per row. Each entry records the
+# source image's mtime, size and sha1, so a sync only re-embeds photos that are new
+# or have actually changed since the last run.
+#
+# Enrolment and deletion are incremental: add() appends one row to the matrix file,
+# remove() marks the row's index entry as deleted (a tombstone), and replace() does
+# both. Tombstoned rows are dropped by compaction, which runs automatically once they
+# make up COMPACT_RATIO of the matrix.
+#
+# A user may have several enrolment photos (templates): users/<name>.jpg and/or any
+# photos in users/<name>/. Captures that disagree with the user's other templates are
+# rejected as outliers, at most MAX_TEMPLATES are kept, and centroids() gives one
+# normalized mean template per user for the first stage of 1:N search.
+#
+# Every commit stores a new random revision id in the index. Arrays derived from the
+# committed gallery (such as the compact search codes in search.py) are cached in
+# gallery_dir as .npy files named after it: the first process that needs one builds it
+# under the gallery lock and every other process memory-maps the same file, so its
+# pages are shared instead of each worker holding a private copy.
+
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+import numpy as np
+import cv2
+from detection import detect_face
+from search import normalize
+
+GALLERY_DIR = 'gallery'
+EMBEDDING_DIM = 512
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+MATRIX_FILE = 'embeddings.f32'
+INDEX_FILE = 'index.json'
+LOCK_FILE = 'gallery.lock'
+LOCK_TIMEOUT = 30
+LOCK_STALE_SECONDS = 120
+COMPACT_RATIO = 0.25
+COMPACT_MIN_TOMBSTONES = 16
+USER_FOLDER = 'users'
+MAX_TEMPLATES = 5
+TEMPLATE_MIN_SIMILARITY = 0.5  # cosine to the centroid of the user's other templates
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def embed_rgb(rgb, mtcnn, resnet):
+    # resnet may also be an EmbeddingService, which batches with concurrent callers
+    face = detect_face(mtcnn, rgb)
+    if face is None:
+        return None
+    if hasattr(resnet, 'embed'):
+        return resnet.embed(face)
+    return resnet(face.unsqueeze(0)).detach().numpy()
+
+
+def embed_image_file(path, mtcnn, resnet):
+    img = cv2.imread(path)
+    if img is None:
+        return None
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return embed_rgb(rgb, mtcnn, resnet)
+
+
+def photo_key(path, user_folder=USER_FOLDER):
+    # 'alice.jpg' for users/alice.jpg, 'alice/2.jpg' for users/alice/2.jpg
+    rel = os.path.relpath(path, user_folder)
+    if rel.startswith('..'):
+        rel = os.path.basename(path)
+    return rel.replace(os.sep, '/')
+
+
+def photo_owner(key):
+    # Username for a photo key: the subfolder name, else the file name without extension
+    folder, _, fname = key.rpartition('/')
+    return folder or os.path.splitext(fname)[0]
+
+
+def list_photos(user_folder):
+    # Photo keys in user_folder and its per-user subfolders, sorted
+    keys = []
+    for fname in sorted(os.listdir(user_folder)):
+        path = os.path.join(user_folder, fname)
+        if os.path.isdir(path):
+            keys.extend(f'{fname}/{f}' for f in sorted(os.listdir(path)) if f.lower().endswith(IMAGE_EXTENSIONS))
+        elif fname.lower().endswith(IMAGE_EXTENSIONS):
+            keys.append(fname)
+    return keys
+
+
+def capture_paths(user_folder, name, exts):
+    # Paths for new captures of one user, one per extension: users/<name>.<ext> for a
+    # single photo, otherwise the next free users/<name>/capture_NN.<ext>
+    if len(exts) == 1:
+        return [os.path.join(user_folder, f'{name}.{exts[0]}')]
+    folder = os.path.join(user_folder, name)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    taken = [int(f[8:10]) for f in os.listdir(folder) if f.startswith('capture_') and f[8:10].isdigit()]
+    start = max(taken, default=0) + 1
+    return [os.path.join(folder, f'capture_{i:02d}.{ext}') for i, ext in enumerate(exts, start)]
+
+
+def select_templates(existing, new, min_similarity=TEMPLATE_MIN_SIMILARITY, max_templates=MAX_TEMPLATES):
+    # Boolean mask over `new` embeddings to enrol next to the user's `existing` ones.
+    # With three or more templates in total, a capture whose cosine to the centroid of
+    # all the others is below min_similarity is an outlier; after that, new captures
+    # are added best-first until the user has max_templates.
+    existing = np.asarray(existing, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    new = np.asarray(new, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    x = normalize(np.vstack([existing, new]))
+    keep = np.ones(len(new), dtype=bool)
+    sims = np.ones(len(new), dtype=np.float32)
+    if len(x) >= 3:
+        others = normalize(x.sum(axis=0, keepdims=True) - x)
+        sims = (x * others).sum(axis=1)[len(existing):]
+        keep = sims >= min_similarity
+        if not len(existing) and not keep.any():
+            keep[np.argmax(sims)] = True  # never reject every capture of a new user
+    room = max(0, max_templates - len(existing))
+    if keep.sum() > room:
+        ranked = [i for i in np.argsort(-sims) if keep[i]]
+        keep[:] = False
+        keep[ranked[:room]] = True
+    return keep
+
+
+def file_entry(name, path, sha1=None, user_folder=USER_FOLDER):
+    st = os.stat(path)
+    return {
+        'name': name,
+        'file': photo_key(path, user_folder),
+        'mtime': st.st_mtime_ns,
+        'size': st.st_size,
+        'sha1': sha1 or file_sha1(path),
+    }
+
+
+def _atomic_write(path, data, mode='w'):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, mode) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class EmbeddingGallery:
+    def __init__(self, gallery_dir=GALLERY_DIR, dim=EMBEDDING_DIM):
+        self.gallery_dir = gallery_dir
+        self.dim = dim
+        self.matrix_path = os.path.join(gallery_dir, MATRIX_FILE)
+        self.index_path = os.path.join(gallery_dir, INDEX_FILE)
+        self.lock_path = os.path.join(gallery_dir, LOCK_FILE)
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        # Bumped on every change so search indexes built on the live view know to rebuild
+        self.version = 0
+        if not os.path.exists(gallery_dir):
+            os.makedirs(gallery_dir)
+        self.load()
+
+    # --- Live view (tombstoned rows excluded) ---
+    @property
+    def embeddings(self):
+        if self._live_embeddings is None:
+            rows = self._matrix[:self._rows]
+            alive = self._alive[:self._rows]
+            self._live_embeddings = rows if alive.all() else rows[alive]
+        return self._live_embeddings
+
+    @property
+    def names(self):
+        if self._live_names is None:
+            self._live_names = [e['name'] for e in self.entries if not e.get('deleted')]
+        return self._live_names
+
+    def __len__(self):
+        return int(self._alive[:self._rows].sum())
+
+    def __contains__(self, name):
+        return bool(self._by_name.get(name))
+
+    def get(self, name):
+        # Enrolled embeddings for one user, shape (rows, dim); empty if not enrolled
+        rows = self._by_name.get(name, [])
+        return np.array(self._matrix[rows], dtype=np.float32).reshape(len(rows), self.dim)
+
+    @property
+    def tombstones(self):
+        return self._rows - len(self)
+
+    def _invalidate(self):
+        self.version += 1
+        self._live_embeddings = None
+        self._live_names = None
+        self._users = None
+        self._centroids = None
+        self._centroid_names = None
+
+    def _centroid_groups(self):
+        # (row order sorted by name, start of each user's run, user names)
+        names = np.array(self.names, dtype=object)
+        order = np.argsort(names, kind='stable')
+        sorted_names = names[order]
+        starts = np.flatnonzero(np.r_[True, sorted_names[1:] != sorted_names[:-1]]) if len(names) else order
+        return order, starts, sorted_names[starts].tolist()
+
+    def centroid_names(self):
+        # User names in centroids() row order, cached per version
+        if self._centroid_names is None:
+            self._centroid_names = self._centroid_groups()[2]
+        return self._centroid_names
+
+    def centroids(self, cache=True):
+        # (names, (users, dim) normalized centroid of each user's templates), cached per version
+        if self._centroids is not None:
+            return self._centroids
+        order, starts, names = self._centroid_groups()
+        if not len(names):
+            centroids = np.zeros((0, self.dim), dtype=np.float32)
+        else:
+            centroids = normalize(np.add.reduceat(normalize(self.embeddings)[order], starts, axis=0))
+        self._centroid_names = names
+        if cache:
+            self._centroids = (names, centroids)
+        return names, centroids
+
+    def cached_arrays(self, tag, keys, build):
+        # {key: read-only memmap} of the arrays build() derives from the committed gallery,
+        # computed once per revision by whichever process asks first
+        if not all(os.path.exists(p) for p in self._cached_paths(tag, keys).values()):
+            with self._locked():
+                self.refresh()
+                paths = self._cached_paths(tag, keys)
+                if not all(os.path.exists(p) for p in paths.values()):
+                    arrays = build()
+                    for key in keys:
+                        with open(paths[key] + '.tmp', 'wb') as f:
+                            np.save(f, arrays[key])
+                        os.replace(paths[key] + '.tmp', paths[key])
+                    self._remove_stale(tag)
+        return {key: np.load(path, mmap_mode='r') for key, path in self._cached_paths(tag, keys).items()}
+
+    def _cached_paths(self, tag, keys):
+        return {key: os.path.join(self.gallery_dir, f'{tag}.{self.revision}.{key}.npy') for key in keys}
+
+    def _remove_stale(self, tag):
+        prefix, current = f'{tag}.', f'{tag}.{self.revision}.'
+        for fname in os.listdir(self.gallery_dir):
+            if fname.startswith(prefix) and not fname.startswith(current):
+                try:
+                    os.remove(os.path.join(self.gallery_dir, fname))
+                except OSError:
+                    pass  # still mapped by another process on Windows; removed on a later build
+
+    def users(self):
+        # (name, file, sha1) for every enrolment photo, including those with no detectable
+        # face, sorted by name; the admin listing pages through this instead of the folder
+        if self._users is None:
+            users = [(e['name'], e['file'], e['sha1']) for e in self.entries
+                     if not e.get('deleted') and e.get('file')]
+            users += [(photo_owner(f), f, r['sha1']) for f, r in self.rejected.items()]
+            self._users = sorted(users, key=lambda u: (u[0].lower(), u[1]))
+        return self._users
+
+    # --- Persistence ---
+    def load(self):
+        self._reset()
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'r') as f:
+            index = json.load(f)
+        entries = index.get('entries', [])
+        rows = len(entries)
+        expected = rows * self.dim * 4
+        if index.get('dim') != self.dim or not os.path.exists(self.matrix_path) \
+                or os.path.getsize(self.matrix_path) < expected:
+            # Matrix and index disagree (interrupted write); start over and let sync rebuild
+            return
+        if rows:
+            self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+        self.entries = entries
+        self.rejected = index.get('rejected', {})
+        self.revision = index.get('revision', '0')
+        self._rows = rows
+        self._persisted_rows = rows
+        self._alive = np.array([not e.get('deleted') for e in entries], dtype=bool)
+        for i, e in enumerate(entries):
+            if not e.get('deleted'):
+                self._track(i, e)
+        self._index_mtime = os.stat(self.index_path).st_mtime_ns
+
+    def _reset(self):
+        self.entries = []
+        self.rejected = {}
+        self.revision = '0'
+        self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._rows = 0
+        self._persisted_rows = 0
+        self._index_mtime = None
+        # name -> live rows and file -> live rows, kept in step with the tombstones
+        self._by_name = {}
+        self._by_file = {}
+        self._invalidate()
+
+    def _write_index(self):
+        self.revision = os.urandom(8).hex()
+        _atomic_write(self.index_path, json.dumps({
+            'dim': self.dim, 'entries': self.entries, 'rejected': self.rejected, 'revision': self.revision}))
+        self._index_mtime = os.stat(self.index_path).st_mtime_ns
+
+    def _commit(self):
+        # Write only the rows added since the last commit, then publish the index
+        self._users = None
+        if self._rows > self._persisted_rows:
+            offset = self._persisted_rows * self.dim * 4
+            mode = 'r+b' if os.path.exists(self.matrix_path) else 'wb'
+            with open(self.matrix_path, mode) as f:
+                f.seek(offset)
+                f.write(np.ascontiguousarray(self._matrix[self._persisted_rows:self._rows]).tobytes())
+                f.truncate()
+            self._persisted_rows = self._rows
+        if self.tombstones >= COMPACT_MIN_TOMBSTONES and self.tombstones >= COMPACT_RATIO * self._rows:
+            self._compact()
+        else:
+            self._write_index()
+
+    def _compact(self):
+        live = np.ascontiguousarray(self.embeddings, dtype=np.float32)
+        self.entries = [e for e in self.entries if not e.get('deleted')]
+        _atomic_write(self.matrix_path, live.tobytes(), mode='wb')
+        self._write_index()
+        self.load()
+
+    def compact(self):
+        with self._locked():
+            self.refresh()
+            if self.tombstones:
+                self._compact()
+
+    def refresh(self):
+        # Pick up changes written by another process (e.g. Flask /register while Streamlit runs)
+        if not os.path.exists(self.index_path):
+            return False
+        mtime = os.stat(self.index_path).st_mtime_ns
+        if mtime == self._index_mtime:
+            return False
+        self.load()
+        return True
+
+    @contextmanager
+    def _locked(self):
+        # Serialises writers across threads and across the Flask/Streamlit/CLI processes
+        with self._thread_lock:
+            if self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            deadline = time.time() + LOCK_TIMEOUT
+            while True:
+                try:
+                    fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                    break
+                except FileExistsError:
+                    try:
+                        if time.time() - os.path.getmtime(self.lock_path) > LOCK_STALE_SECONDS:
+                            os.remove(self.lock_path)
+                            continue
+                    except OSError:
+                        continue
+                    if time.time() > deadline:
+                        raise TimeoutError(f'Timed out waiting for gallery lock {self.lock_path}')
+                    time.sleep(0.01)
+            self._lock_depth = 1
+            try:
+                yield
+            finally:
+                self._lock_depth = 0
+                os.close(fd)
+                os.remove(self.lock_path)
+
+    # --- Incremental updates ---
+    def _ensure_capacity(self, rows):
+        if isinstance(self._matrix, np.memmap) or self._matrix.shape[0] < rows:
+            capacity = max(rows, 2 * self._matrix.shape[0], 64)
+            matrix = np.empty((capacity, self.dim), dtype=np.float32)
+            matrix[:self._rows] = self._matrix[:self._rows]
+            self._matrix = matrix
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:self._rows] = self._alive[:self._rows]
+            self._alive = alive
+
+    def _track(self, row, entry):
+        self._by_name.setdefault(entry['name'], []).append(row)
+        if entry.get('file'):
+            self._by_file.setdefault(entry['file'], []).append(row)
+
+    def _untrack(self, row, entry):
+        for key, rows_by in ((entry['name'], self._by_name), (entry.get('file'), self._by_file)):
+            rows = rows_by.get(key)
+            if rows and row in rows:
+                rows.remove(row)
+                if not rows:
+                    del rows_by[key]
+
+    def _live_rows(self, name=None, file=None):
+        if file is not None:
+            return [i for i in self._by_file.get(file, []) if name is None or self.entries[i]['name'] == name]
+        if name is not None:
+            return list(self._by_name.get(name, []))
+        return [i for i in range(self._rows) if self._alive[i]]
+
+    def _tombstone(self, rows):
+        for i in rows:
+            self.entries[i]['deleted'] = True
+            self._alive[i] = False
+            self._untrack(i, self.entries[i])
+        if rows:
+            self._invalidate()
+        return len(rows)
+
+    def _append(self, entry, emb):
+        if entry.get('file'):
+            self._tombstone(self._live_rows(file=entry['file']))
+            self.rejected.pop(entry['file'], None)
+        self._ensure_capacity(self._rows + 1)
+        self._matrix[self._rows] = np.asarray(emb, dtype=np.float32).reshape(self.dim)
+        self._alive[self._rows] = True
+        self.entries.append(dict(entry, deleted=False))
+        self._track(self._rows, self.entries[-1])
+        self._rows += 1
+        self._invalidate()
+        return self._rows - 1
+
+    def add(self, name, emb, path=None):
+        # Enrol one embedding; with a path, any previous row for the same file is replaced
+        entry = file_entry(name, path) if path else {'name': name, 'file': None}
+        with self._locked():
+            self.refresh()
+            row = self._append(entry, emb)
+            self._commit()
+        return row
+
+    def add_many(self, items):
+        # Bulk enrolment: items are (name, emb, path) tuples, published with a single commit
+        entries = [(file_entry(name, path) if path else {'name': name, 'file': None}, emb)
+                   for name, emb, path in items]
+        with self._locked():
+            self.refresh()
+            for entry, emb in entries:
+                self._append(entry, emb)
+            self._commit()
+        return len(entries)
+
+    def replace(self, name, emb, path=None):
+        # Swap every live row for this user for a single new embedding
+        entry = file_entry(name, path) if path else {'name': name, 'file': None}
+        with self._locked():
+            self.refresh()
+            self._tombstone(self._live_rows(name=name))
+            row = self._append(entry, emb)
+            self._commit()
+        return row
+
+    def remove(self, name=None, file=None):
+        with self._locked():
+            self.refresh()
+            removed = self._tombstone(self._live_rows(name=name, file=file))
+            # Rejected photos of the file, or of every file the user owns
+            forget = [f for f in self.rejected if f == file or (file is None and photo_owner(f) == name)]
+            for f in forget:
+                del self.rejected[f]
+            if removed or forget:
+                self._commit()
+        return removed
+
+    def add_image(self, path, mtcnn, resnet, name=None):
+        # Embed one enrolment photo and add it; returns False if no face was found
+        emb = embed_image_file(path, mtcnn, resnet)
+        if emb is None:
+            return False
+        self.add(name or photo_owner(photo_key(path)), emb, path)
+        return True
+
+    # --- Folder synchronisation ---
+    def _select_new_templates(self, added, keep_files):
+        # Split newly embedded photos into accepted templates and rejected outliers, per
+        # user, against the user's templates that stay enrolled
+        accepted, outliers = [], []
+        by_owner = {}
+        for entry, emb in added:
+            by_owner.setdefault(entry['name'], []).append((entry, emb))
+        replaced = {entry['file'] for entry, _ in added}
+        for name, items in by_owner.items():
+            rows = [i for i in self._live_rows(name=name)
+                    if self.entries[i].get('file') not in replaced
+                    and (self.entries[i].get('file') is None or self.entries[i]['file'] in keep_files)]
+            existing = np.asarray(self._matrix[rows], dtype=np.float32).reshape(len(rows), self.dim)
+            keep = select_templates(existing, [emb for _, emb in items])
+            for (entry, emb), ok in zip(items, keep):
+                (accepted if ok else outliers).append((entry, emb))
+        return accepted, outliers
+
+    def sync(self, user_folder, mtcnn, resnet):
+        # Photos are users/<name>.jpg (one template) and users/<name>/*.jpg (several).
+        # Rejected photos (no face, outlier, over MAX_TEMPLATES) are remembered by content
+        # and not embedded again until the file changes.
+        if not os.path.exists(user_folder):
+            os.makedirs(user_folder)
+        live = {self.entries[i]['file']: self.entries[i] for i in self._live_rows() if self.entries[i].get('file')}
+        added = []
+        touched = []
+        rejected = {}
+        seen = set()
+        for key in list_photos(user_folder):
+            seen.add(key)
+            img_path = os.path.join(user_folder, *key.split('/'))
+            st = os.stat(img_path)
+            entry = live.get(key)
+            if entry is not None:
+                if entry['mtime'] == st.st_mtime_ns and entry['size'] == st.st_size:
+                    continue
+                sha1 = file_sha1(img_path)
+                if entry['sha1'] == sha1:
+                    # Touched but identical content: keep the embedding, refresh the key
+                    touched.append((key, st))
+                    continue
+            else:
+                known = self.rejected.get(key)
+                if known is not None and known['mtime'] == st.st_mtime_ns and known['size'] == st.st_size:
+                    rejected[key] = known
+                    continue
+                sha1 = file_sha1(img_path)
+                if known is not None and known['sha1'] == sha1:
+                    # Already rejected with this content; don't run MTCNN again
+                    rejected[key] = dict(known, mtime=st.st_mtime_ns, size=st.st_size)
+                    continue
+            emb = embed_image_file(img_path, mtcnn, resnet)
+            if emb is None:
+                rejected[key] = {'mtime': st.st_mtime_ns, 'size': st.st_size, 'sha1': sha1, 'reason': 'no_face'}
+                continue
+            added.append((file_entry(photo_owner(key), img_path, sha1, user_folder), emb))
+        removed = [f for f in live if f not in seen]
+        if not (added or touched or removed or rejected != self.rejected):
+            return False
+        with self._locked():
+            self.refresh()
+            added, outliers = self._select_new_templates(added, seen)
+            for entry, _ in outliers:
+                rejected[entry['file']] = {'mtime': entry['mtime'], 'size': entry['size'], 'sha1': entry['sha1'],
+                                           'reason': 'outlier'}
+            for fname in removed:
+                self._tombstone(self._live_rows(file=fname))
+            for fname, st in touched:
+                for i in self._live_rows(file=fname):
+                    self.entries[i].update(mtime=st.st_mtime_ns, size=st.st_size)
+            for entry, emb in added:
+                self._append(entry, emb)
+            self.rejected = rejected
+            self._commit()
+        return True
+
+
+_shared_galleries = {}
+
+
+def get_gallery(gallery_dir=GALLERY_DIR):
+    # One gallery object per process and directory; cheap to call on every request
+    gallery = _shared_galleries.get(gallery_dir)
+    if gallery is None:
+        gallery = EmbeddingGallery(gallery_dir)
+        _shared_galleries[gallery_dir] = gallery
+    else:
+        gallery.refresh()
+    return gallery
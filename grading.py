@@ -0,0 +1,106 @@
+# Vectorized grading and item analysis
+#
+# Answers are held as int8 arrays: the chosen option index (in the bank's option
+# order), UNANSWERED for a question on the paper left blank, NOT_PRESENTED for a
+# question that was not on the candidate's paper. A cohort is a (candidates x
+# questions) matrix of these, so grading everyone and computing item statistics are
+# a few array comparisons and column sums instead of per-candidate Python loops.
+#
+# Item analysis follows the usual classical test theory definitions: difficulty is
+# the proportion of candidates presented with an item who answered it correctly;
+# discrimination is that proportion in the top UPPER_LOWER_FRACTION of candidates
+# (by percentage score) minus the proportion in the bottom fraction.
+
+import numpy as np
+
+UNANSWERED = -1
+NOT_PRESENTED = -2
+UPPER_LOWER_FRACTION = 0.27
+
+
+def answer_vector(paper, answers):
+    # A candidate's answers as an int8 array aligned with paper.ids
+    return np.array([answers.get(int(qid), UNANSWERED) for qid in paper.ids], dtype=np.int8)
+
+
+def grade_paper(paper, answers):
+    # (score, per-question correctness) for one candidate
+    correct = answer_vector(paper, answers) == paper.bank.answers[paper.positions]
+    return int(correct.sum()), correct
+
+
+class ResponseMatrix:
+    def __init__(self, usernames, positions, responses):
+        self.usernames = usernames    # one per row
+        self.positions = positions    # bank position of each column
+        self.responses = responses    # int8 (candidates, questions)
+
+    @classmethod
+    def from_sessions(cls, sessions, bank, course=None):
+        # Rows for submitted sessions whose paper includes at least one of the course's questions
+        positions = bank.positions(course)
+        column = np.full(len(bank), -1, dtype=np.int64)
+        column[positions] = np.arange(len(positions))
+        usernames, rows = [], []
+        for session in sessions:
+            row = np.full(len(positions), NOT_PRESENTED, dtype=np.int8)
+            on_paper = [bank.positions_by_id[q] for q in session.paper if q in bank.positions_by_id]
+            cols = column[np.array(on_paper, dtype=np.int64)] if on_paper else np.zeros(0, dtype=np.int64)
+            cols = cols[cols >= 0]
+            if not len(cols):
+                continue
+            row[cols] = UNANSWERED
+            answered = [(bank.positions_by_id[q], a) for q, a in session.answers.items() if q in bank.positions_by_id]
+            if answered:
+                pos, choice = np.array(answered, dtype=np.int64).T
+                keep = column[pos] >= 0
+                row[column[pos[keep]]] = choice[keep]
+            usernames.append(session.username)
+            rows.append(row)
+        responses = np.stack(rows) if rows else np.zeros((0, len(positions)), dtype=np.int8)
+        return cls(usernames, positions, responses)
+
+    def __len__(self):
+        return len(self.usernames)
+
+
+def grade_cohort(matrix, bank):
+    # Correct-answer matrix plus raw scores, questions presented and percentage per candidate
+    correct = matrix.responses == bank.answers[matrix.positions][None, :]
+    presented = matrix.responses != NOT_PRESENTED
+    scores = correct.sum(axis=1)
+    totals = presented.sum(axis=1)
+    percent = np.divide(scores * 100.0, totals, out=np.zeros(len(scores)), where=totals > 0)
+    return {'correct': correct, 'presented': presented, 'scores': scores, 'totals': totals, 'percent': percent}
+
+
+def _proportion(correct, presented):
+    n = presented.sum(axis=0)
+    return np.divide(correct.sum(axis=0), n, out=np.full(correct.shape[1], np.nan), where=n > 0)
+
+
+def item_analysis(matrix, bank, max_options=None):
+    graded = grade_cohort(matrix, bank)
+    correct, presented, percent = graded['correct'], graded['presented'], graded['percent']
+    responses = matrix.responses
+    if max_options is None:
+        max_options = max([len(bank.questions[p]['options']) for p in matrix.positions] or [0])
+    difficulty = _proportion(correct, presented)
+    discrimination = np.full(len(matrix.positions), np.nan)
+    if len(matrix):
+        k = max(1, int(round(UPPER_LOWER_FRACTION * len(matrix))))
+        order = np.argsort(percent, kind='stable')
+        lower, upper = order[:k], order[-k:]
+        discrimination = _proportion(correct[upper], presented[upper]) - _proportion(correct[lower], presented[lower])
+    # distractors[i, o]: how many candidates chose option o on item i
+    distractors = np.stack([(responses == o).sum(axis=0) for o in range(max_options)], axis=1) \
+        if max_options else np.zeros((len(matrix.positions), 0), dtype=np.int64)
+    return {'positions': matrix.positions, 'presented': presented.sum(axis=0), 'difficulty': difficulty,
+            'discrimination': discrimination, 'distractors': distractors,
+            'omitted': (responses == UNANSWERED).sum(axis=0), 'percent': percent,
+            'scores': graded['scores'], 'totals': graded['totals']}
+
+
+def score_distribution(percent, bins=10):
+    # (counts, bin edges) of percentage scores over 0-100
+    return np.histogram(percent, bins=bins, range=(0, 100))
@@ -0,0 +1,122 @@
+# Process pool for face inference in the Flask serving mode
+#
+# Each worker process loads its own MTCNN/InceptionResnetV1 through models.get_models()
+# and limits torch to WORKER_THREADS intra-op threads, so N workers share the CPU
+# instead of all fighting over every core. Requests hand raw image bytes to a worker
+# and get back an embedding; gallery search stays in the web process. At most
+# MAX_PENDING jobs may be queued or running: beyond that submit() raises PoolBusy and
+# the web layer answers 503 rather than letting latency grow without bound. A job that
+# takes longer than REQUEST_TIMEOUT is reported as PoolBusy too.
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+INFERENCE_WORKERS = int(os.environ.get('CBT_INFERENCE_WORKERS', 0))
+WORKER_THREADS = int(os.environ.get('CBT_WORKER_THREADS', 0))
+MAX_PENDING = int(os.environ.get('CBT_MAX_PENDING', 0))
+REQUEST_TIMEOUT = float(os.environ.get('CBT_REQUEST_TIMEOUT', 30))
+
+
+class PoolBusy(Exception):
+    pass
+
+
+# --- Worker process side ---
+def _init_worker(threads):
+    import torch
+    torch.set_num_threads(threads)
+    from models import get_models
+    get_models()
+
+
+def _embed_bytes(data):
+    # Returns (status, embedding): 'ok', 'no_face' or 'invalid_image'
+    import cv2
+    import numpy as np
+    import torch
+    from models import get_models
+    from detection import detect_face
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return 'invalid_image', None
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    mtcnn, resnet = get_models()
+    face = detect_face(mtcnn, rgb)
+    if face is None:
+        return 'no_face', None
+    with torch.inference_mode():
+        return 'ok', resnet(face.unsqueeze(0)).numpy()
+
+
+# --- Web process side ---
+class InferencePool:
+    def __init__(self, workers, threads_per_worker=0, max_pending=0):
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        self.max_pending = max_pending or workers * 8
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0  # queued or running jobs, guarded by _lock
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        self.workers, initializer=_init_worker, initargs=(self.threads_per_worker,))
+        return self._executor
+
+    def _release(self, _=None):
+        with self._lock:
+            self._in_flight -= 1
+
+    def submit(self, data):
+        with self._lock:
+            if self._in_flight >= self.max_pending:
+                self.rejected += 1
+                raise PoolBusy()
+            self._in_flight += 1
+        try:
+            future = self._get_executor().submit(_embed_bytes, data)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def embed(self, data, timeout=REQUEST_TIMEOUT):
+        future = self.submit(data)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            # The job keeps its slot until a worker finishes it (or drops it, if still queued)
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise PoolBusy()
+
+    def warm_up(self):
+        # Start every worker now so the first requests don't pay for model loading
+        executor = self._get_executor()
+        for f in [executor.submit(os.getpid) for _ in range(self.workers)]:
+            f.result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers, 'threads_per_worker': self.threads_per_worker,
+                    'max_pending': self.max_pending, 'in_flight': self._in_flight, 'rejected': self.rejected,
+                    'timed_out': self.timed_out}
+
+
+def create_pool(workers=INFERENCE_WORKERS, threads_per_worker=WORKER_THREADS, max_pending=MAX_PENDING):
+    # None means in-process inference (the default for development)
+    if workers <= 0:
+        return None
+    return InferencePool(workers, threads_per_worker, max_pending)
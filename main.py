@@ -3,45 +3,35 @@
 
 import cv2
 import torch
-import numpy as np
-from facenet_pytorch import MTCNN, InceptionResnetV1
+from models import get_models
 import os
-from datetime import datetime
-import winsound
-import sys
+import time
+from gallery import get_gallery
+from realtime import RealtimeAuthenticator
+from camera_pipeline import CameraPipeline, Beeper
+from detection import detect_face
+from event_store import get_event_store
+from metrics import AUTH_STAGE_SECONDS, AUTH_TOTAL, stage
 
 # Load face detector and embedding model
-mtcnn = MTCNN(image_size=160, margin=0, min_face_size=40)
-resnet = InceptionResnetV1(pretrained='vggface2').eval()
+mtcnn, resnet = get_models()
 
-# Load all reference images from 'users' folder
+# Load reference embeddings from the persistent gallery (only new/changed images in 'users' are embedded)
 user_folder = 'users'
-user_embeddings = []
-user_names = []
 if not os.path.exists(user_folder):
     os.makedirs(user_folder)
     print(f"Created '{user_folder}' folder. Place reference images inside.")
-for fname in os.listdir(user_folder):
-    if fname.lower().endswith(('.jpg', '.jpeg', '.png')):
-        img_path = os.path.join(user_folder, fname)
-        img = cv2.imread(img_path)
-        if img is None:
-            continue
-        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        face = mtcnn(rgb)
-        if face is not None:
-            emb = resnet(face.unsqueeze(0)).detach().numpy()
-            user_embeddings.append(emb)
-            user_names.append(os.path.splitext(fname)[0])
-if not user_embeddings:
+gallery = get_gallery()
+gallery.sync(user_folder, mtcnn, resnet)
+if len(gallery) == 0:
     raise ValueError("No valid user images found in 'users' folder.")
-user_embeddings = np.vstack(user_embeddings)
 
-# Logging function
-log_file = 'auth_log.txt'
+# Logging function (batched into the shared event store)
+events = get_event_store()
 def log_attempt(user, result):
-    with open(log_file, 'a') as f:
-        f.write(f"{datetime.now()} - {user} - {result}\n")
+    AUTH_TOTAL.inc(source='camera', status=result)
+    with stage('camera', 'log'):
+        events.log_auth(user, result, source='camera')
 
 # User registration function
 def register_user(mtcnn, resnet, user_folder):
@@ -56,76 +46,98 @@ def register_user(mtcnn, resnet, user_folder):
         key = cv2.waitKey(1) & 0xFF
         if key == ord('c'):
             rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            face = mtcnn(rgb)
+            face = detect_face(mtcnn, rgb)
             if face is not None:
                 name = input('Enter username: ')
                 save_path = os.path.join(user_folder, f'{name}.jpg')
                 cv2.imwrite(save_path, frame)
+                emb = resnet(face.unsqueeze(0)).detach().numpy()
+                cap.release()
+                cv2.destroyAllWindows()
                 print(f'User {name} registered.')
-                break
+                return name, emb, save_path
             else:
                 print('No face detected. Try again.')
         elif key == ord('q'):
             break
     cap.release()
     cv2.destroyAllWindows()
+    return None
 
 # Similarity threshold
 SIMILARITY_THRESHOLD = 0.6
 
-# Authentication loop
-cap = cv2.VideoCapture(0)
+# Authentication loop: capture, inference and display run on separate threads
 print('Starting camera for facial authentication...')
+authenticator = RealtimeAuthenticator(mtcnn, resnet, gallery, SIMILARITY_THRESHOLD)
+pipeline = CameraPipeline(authenticator).start()
+beeper = Beeper()
 authenticated = False
+shown = 0
 while True:
-    ret, frame = cap.read()
-    if not ret:
-        print('Failed to capture image from camera.')
-        break
-    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    face = mtcnn(rgb)
-    box = None
-    if face is not None:
-        face = face.unsqueeze(0)
-        emb = resnet(face).detach().numpy()
-        # Cosine similarity for all users
-        sims = np.dot(user_embeddings, emb.T) / (np.linalg.norm(user_embeddings, axis=1, keepdims=True) * np.linalg.norm(emb))
-        best_idx = np.argmax(sims)
-        best_sim = sims[best_idx][0]
-        if best_sim > SIMILARITY_THRESHOLD:
-            name = user_names[best_idx]
-            print(f'Authenticated: {name}!')
-            log_attempt(name, 'SUCCESS')
+    shown, frame = pipeline.frames.get(after=shown, timeout=1.0, consume=False)
+    if frame is None:
+        if pipeline.failed:
+            print('Failed to capture image from camera.')
+            break
+        continue
+    start = time.perf_counter()
+    frame = frame.copy()
+    for event in pipeline.poll_events():
+        if event['box'] is None:
+            continue
+        if event['similarity'] > authenticator.threshold:
+            print(f"Authenticated: {event['name']}!")
+            log_attempt(event['name'], 'SUCCESS')
             authenticated = True
-            cv2.putText(frame, f'Authenticated: {name}', (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,255,0), 2)
-            winsound.Beep(1000, 200)
+            beeper.beep(1000, 200)
         else:
             print('Face not recognized.')
             log_attempt('Unknown', 'FAIL')
+            beeper.beep(400, 400)
+    _, result = pipeline.results.peek()
+    if result is not None and result['box'] is not None:
+        name, best_sim = result['name'], result['similarity']
+        if best_sim > authenticator.threshold:
+            cv2.putText(frame, f'Authenticated: {name}', (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,255,0), 2)
+        else:
             cv2.putText(frame, 'Not recognized', (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,0,255), 2)
-            winsound.Beep(400, 400)
-        # Draw rectangle around detected face
-        boxes, _ = mtcnn.detect(rgb)
-        if boxes is not None:
-            for box in boxes:
-                x1, y1, x2, y2 = [int(b) for b in box]
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 0, 0), 2)
+        # Draw rectangle around the detected/tracked face (same box used for the crop)
+        x1, y1, x2, y2 = [int(b) for b in result['box']]
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 0, 0), 2)
+    inference = pipeline.inference_stats.summary()
+    if 'mean_ms' in inference:
+        cv2.putText(frame, f"inference {inference['mean_ms']:.0f} ms", (10, frame.shape[0] - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255,255,255), 1)
     cv2.imshow('Video', frame)
     key = cv2.waitKey(1) & 0xFF
+    pipeline.display_stats.record(time.perf_counter() - start)
+    AUTH_STAGE_SECONDS.observe(time.perf_counter() - start, source='camera', stage='display')
     if key == ord('q') or authenticated:
         break
     elif key == ord('r'):
-        cap.release()
+        pipeline.stop()
         cv2.destroyAllWindows()
-        register_user(mtcnn, resnet, user_folder)
-        # Reload users after registration
-        os.execv(sys.executable, ['python'] + sys.argv)
+        registered = register_user(mtcnn, resnet, user_folder)
+        if registered is not None:
+            # Add the new user to the in-memory gallery; no model reload or folder rescan
+            name, emb, save_path = registered
+            gallery.add(name, emb, save_path)
+        authenticator.reset()
+        pipeline.start()
     elif key == ord('t'):
         try:
             new_thresh = float(input('Enter new similarity threshold (0-1): '))
             SIMILARITY_THRESHOLD = new_thresh
+            authenticator.threshold = new_thresh
+            authenticator.reset()
             print(f'New threshold set: {SIMILARITY_THRESHOLD}')
         except Exception:
             print('Invalid threshold.')
-cap.release()
+    elif key == ord('s'):
+        print(pipeline.stats())
+        for (source, name), s in AUTH_STAGE_SECONDS.snapshot().items():
+            print(f"  {name:<8} n={s['count']} p50={s['p50_ms']:.1f}ms p95={s['p95_ms']:.1f}ms max={s['max_ms']:.1f}ms")
+pipeline.stop()
+print(pipeline.stats())
 cv2.destroyAllWindows()
@@ -0,0 +1,289 @@
+# Lightweight in-process metrics and slow-request profiling
+#
+# Counters, gauges and histograms with labels, kept per process and rendered in the
+# Prometheus text format (Flask serves it on /metrics) or as a snapshot dict for the
+# Admin Dashboard. Recording is a dict lookup and a few additions under a lock, cheap
+# enough to leave on around every stage of a login.
+#
+# The authentication paths of app.py, app_streamlit.py and main.py time their stages
+# (decode, detect, embed, gallery, search, log, ...) into AUTH_STAGE_SECONDS, their
+# whole attempt into AUTH_SECONDS and count outcomes in AUTH_TOTAL, each labelled
+# with the source, so a slow login can be attributed to one stage.
+#
+# With PROFILE_SLOW_MS > 0 (env CBT_PROFILE_SLOW_MS), profile() also samples the
+# calling thread's stack every PROFILE_INTERVAL_MS from one shared sampler thread; a
+# block that takes longer than the limit has its samples written to PROFILE_DIR as
+# folded stacks ("frame;frame;frame count" lines), the input format of flamegraph.pl
+# and speedscope.
+
+import os
+import sys
+import time
+import bisect
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROFILE_SLOW_MS = float(os.environ.get('CBT_PROFILE_SLOW_MS', 0))
+PROFILE_INTERVAL_MS = float(os.environ.get('CBT_PROFILE_INTERVAL_MS', 5))
+PROFILE_DIR = os.environ.get('CBT_PROFILE_DIR', 'profiles')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, '')) for n in self.labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines += self._render_items(items)
+        return lines
+
+    def _render_items(self, items):
+        return [f'{self.name}{_label_text(self.labels, key)} {value:g}' for key, value in items]
+
+
+class CounterMetric(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class GaugeMetric(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class HistogramMetric(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # [per-bucket counts (last is +Inf), count, sum, max]
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0, 0.0, 0.0]
+            series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+            series[3] = max(series[3], value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_items(self, items):
+        lines = []
+        for key, (counts, count, total, _) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'{self.name}_bucket{_label_text(self.labels, key, [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_count{_label_text(self.labels, key)} {count}')
+            lines.append(f'{self.name}_sum{_label_text(self.labels, key)} {total:g}')
+        return lines
+
+    def _quantile(self, counts, count, q):
+        # Linear interpolation inside the bucket holding the q-th observation
+        rank, cumulative, lower = q * count, 0, 0.0
+        for bound, n in zip(self.buckets, counts):
+            if n and cumulative + n >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / n
+            cumulative += n
+            lower = bound
+        return self.buckets[-1]
+
+    def snapshot(self):
+        # {label values: {'count', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms'}}
+        with self._lock:
+            items = [(key, (list(s[0]), s[1], s[2], s[3])) for key, s in self._values.items()]
+        return {key: {'count': count, 'mean_ms': 1000.0 * total / count,
+                      'p50_ms': 1000.0 * min(self._quantile(counts, count, 0.5), peak),
+                      'p95_ms': 1000.0 * min(self._quantile(counts, count, 0.95), peak),
+                      'max_ms': 1000.0 * peak}
+                for key, (counts, count, total, peak) in sorted(items) if count}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, labels, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._get(CounterMetric, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=()):
+        return self._get(GaugeMetric, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get(HistogramMetric, name, help_text, labels, buckets=buckets)
+
+    def render(self):
+        # Prometheus text exposition format (version 0.0.4)
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(line for m in metrics for line in m.render()) + '\n'
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._metrics)
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry():
+    return _registry
+
+
+AUTH_STAGE_SECONDS = _registry.histogram('cbt_auth_stage_seconds', 'Time spent in one stage of an authentication',
+                                         ('source', 'stage'))
+AUTH_SECONDS = _registry.histogram('cbt_auth_seconds', 'End-to-end time of an authentication attempt',
+                                   ('source',))
+AUTH_TOTAL = _registry.counter('cbt_auth_total', 'Authentication attempts by outcome', ('source', 'status'))
+SLOW_PROFILES_TOTAL = _registry.counter('cbt_slow_profiles_total', 'Slow blocks written out as folded stacks',
+                                        ('name',))
+
+
+def stage(source, name):
+    # with stage('flask', 'detect'): ...
+    return AUTH_STAGE_SECONDS.time(source=source, stage=name)
+
+
+# --- Sampling profiler for slow blocks ---
+class SlowBlockProfiler:
+    def __init__(self, slow_ms=PROFILE_SLOW_MS, interval_ms=PROFILE_INTERVAL_MS, out_dir=PROFILE_DIR):
+        self.slow = slow_ms / 1000.0
+        self.interval = interval_ms / 1000.0
+        self.out_dir = out_dir
+        self._active = {}  # thread id -> Counter of folded stacks
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.slow > 0
+
+    def _ensure_sampler(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._sample_loop, name='slow-profiler', daemon=True)
+            self._thread.start()
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, stacks in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stacks[_fold(frame)] += 1
+
+    @contextmanager
+    def profile(self, name):
+        if not self.enabled:
+            yield
+            return
+        thread_id = threading.get_ident()
+        stacks = Counter()
+        with self._lock:
+            nested = thread_id in self._active
+            if not nested:
+                self._active[thread_id] = stacks
+                self._ensure_sampler()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if not nested:
+                with self._lock:
+                    self._active.pop(thread_id, None)
+                elapsed = time.perf_counter() - start
+                if elapsed >= self.slow and stacks:
+                    self._dump(name, elapsed, stacks)
+
+    def _dump(self, name, elapsed, stacks):
+        if not os.path.exists(self.out_dir):
+            os.makedirs(self.out_dir)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(self.out_dir, f'{stamp}_{name}_{int(elapsed * 1000)}ms_{threading.get_ident()}.folded')
+        with open(path, 'w') as f:
+            f.writelines(f'{stack} {count}\n' for stack, count in stacks.most_common())
+        SLOW_PROFILES_TOTAL.inc(name=name)
+
+
+def _fold(frame):
+    # Outermost-first 'function (file:first line)' frames joined by ';'
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(parts))
+
+
+_profiler = SlowBlockProfiler()
+
+
+def profile(name):
+    # Samples the block's stack when CBT_PROFILE_SLOW_MS is set; a no-op otherwise
+    return _profiler.profile(name)
+
+
+def get_profiler():
+    return _profiler
@@ -0,0 +1,99 @@
+# Optimized CPU inference backends for InceptionResnetV1
+#
+# EMBED_BACKEND (env CBT_EMBED_BACKEND) picks how the embedding network runs:
+#   eager        the fp32 module as loaded (reference)
+#   int8         dynamic int8 quantization of the Linear layers (weights stored as int8,
+#                activations quantized per batch); the convolutions stay fp32
+#   torchscript  traced, frozen and optimize_for_inference'd TorchScript graph
+#   compile      torch.compile (inductor); the first call of each batch size compiles
+#   onnx         exported once to MODEL_CACHE_DIR and run with ONNX Runtime (optional
+#                dependencies: pip install onnx onnxscript onnxruntime)
+#
+# Every backend is a drop-in callable: (batch, 3, 160, 160) float tensor in, (batch,
+# 512) float tensor out, so the embedding service, inference pool and realtime loop
+# use it unchanged. A backend that can't be built falls back to eager with a message.
+# Gallery embeddings stay as enrolled with fp32; run benchmarks/bench_embedding.py to measure
+# how far a backend's embeddings drift from them before switching a deployment.
+
+import os
+import torch
+
+EMBED_BACKEND = os.environ.get('CBT_EMBED_BACKEND', 'eager')
+BACKENDS = ('eager', 'int8', 'torchscript', 'compile', 'onnx')
+MODEL_CACHE_DIR = os.environ.get('CBT_MODEL_CACHE', 'model_cache')
+FACE_SHAPE = (3, 160, 160)
+
+
+def _example(batch=1):
+    return torch.zeros(batch, *FACE_SHAPE)
+
+
+def quantize_int8(resnet):
+    return torch.ao.quantization.quantize_dynamic(resnet, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def to_torchscript(resnet):
+    with torch.no_grad():
+        traced = torch.jit.trace(resnet, _example(2))
+        return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+
+def compile_resnet(resnet):
+    compiled = torch.compile(resnet, dynamic=True)
+    with torch.no_grad():
+        compiled(_example(1))  # compile now rather than on the first login
+    return compiled
+
+
+class OnnxResnet:
+    # ONNX Runtime session behind the same call signature as the torch module
+    def __init__(self, path, threads=0):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.path = path
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, faces):
+        out = self.session.run(None, {self.input_name: faces.detach().numpy().astype('float32', copy=False)})[0]
+        return torch.from_numpy(out)
+
+    def eval(self):
+        return self
+
+
+def export_onnx(resnet, path):
+    tmp_path = path + '.tmp'
+    with torch.no_grad():
+        torch.onnx.export(resnet, _example(1), tmp_path, input_names=['faces'], output_names=['embeddings'],
+                          dynamic_axes={'faces': {0: 'batch'}, 'embeddings': {0: 'batch'}}, opset_version=17)
+    os.replace(tmp_path, path)
+
+
+def to_onnx(resnet, name='resnet'):
+    # The exported graph is reused across processes and restarts
+    import onnxruntime  # noqa: F401 -- fail before exporting if the runtime is missing
+    if not os.path.exists(MODEL_CACHE_DIR):
+        os.makedirs(MODEL_CACHE_DIR)
+    path = os.path.join(MODEL_CACHE_DIR, f'{name}.onnx')
+    if not os.path.exists(path):
+        export_onnx(resnet, path)
+    return OnnxResnet(path, torch.get_num_threads())
+
+
+def optimize_resnet(resnet, backend=EMBED_BACKEND, name='resnet'):
+    # The eval-mode fp32 module wrapped for `backend`; eager on failure
+    if backend == 'eager':
+        return resnet
+    builders = {'int8': quantize_int8, 'torchscript': to_torchscript, 'compile': compile_resnet,
+                'onnx': lambda m: to_onnx(m, name)}
+    if backend not in builders:
+        raise ValueError(f'Unknown embedding backend: {backend} (choose from {", ".join(BACKENDS)})')
+    try:
+        return builders[backend](resnet)
+    except Exception as e:
+        print(f'Embedding backend {backend!r} unavailable ({e}); using eager fp32')
+        return resnet
@@ -0,0 +1,85 @@
+# Process-wide face model registry shared by app.py, app_streamlit.py and main.py
+#
+# MTCNN and InceptionResnetV1 are built once per process on first use and warmed up
+# with a dummy inference, so the first real login doesn't pay for lazy allocations.
+# Streamlit re-runs app_streamlit.py on every widget interaction but keeps imported
+# modules, so get_models() there returns the already loaded pair.
+#
+# The embedding network runs through the backend chosen by CBT_EMBED_BACKEND (see
+# model_backends.py); the default is the eager fp32 module.
+
+import time
+import threading
+import numpy as np
+import torch
+from facenet_pytorch import MTCNN, InceptionResnetV1
+from model_backends import EMBED_BACKEND, optimize_resnet
+
+MTCNN_OPTIONS = {'image_size': 160, 'margin': 0, 'min_face_size': 40}
+RESNET_PRETRAINED = 'vggface2'
+
+_lock = threading.Lock()
+_models = None
+_metrics = {
+    'loaded': False,
+    'backend': None,
+    'get_calls': 0,
+    'mtcnn_load_s': None,
+    'resnet_load_s': None,
+    'backend_build_s': None,
+    'cold_detect_s': None,
+    'cold_embed_s': None,
+    'warm_detect_s': None,
+    'warm_embed_s': None,
+    'total_startup_s': None,
+    'last_get_s': None,
+}
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def _warm_up(mtcnn, resnet):
+    # First inference allocates buffers and picks kernels; time it separately from a warm call
+    blank = np.zeros((MTCNN_OPTIONS['image_size'], MTCNN_OPTIONS['image_size'], 3), dtype=np.uint8)
+    face = torch.zeros(1, 3, MTCNN_OPTIONS['image_size'], MTCNN_OPTIONS['image_size'])
+    with torch.no_grad():
+        _, _metrics['cold_detect_s'] = _timed(lambda: mtcnn.detect(blank))
+        _, _metrics['cold_embed_s'] = _timed(lambda: resnet(face))
+        _, _metrics['warm_detect_s'] = _timed(lambda: mtcnn.detect(blank))
+        _, _metrics['warm_embed_s'] = _timed(lambda: resnet(face))
+
+
+def load_models(warm_up=True, backend=EMBED_BACKEND):
+    start = time.perf_counter()
+    mtcnn, _metrics['mtcnn_load_s'] = _timed(lambda: MTCNN(**MTCNN_OPTIONS))
+    fp32, _metrics['resnet_load_s'] = _timed(lambda: InceptionResnetV1(pretrained=RESNET_PRETRAINED).eval())
+    resnet, _metrics['backend_build_s'] = _timed(
+        lambda: optimize_resnet(fp32, backend, name=f'resnet_{RESNET_PRETRAINED}'))
+    _metrics['backend'] = backend if resnet is not fp32 else 'eager'
+    if warm_up:
+        _warm_up(mtcnn, resnet)
+    _metrics['total_startup_s'] = time.perf_counter() - start
+    _metrics['loaded'] = True
+    print(f"Face models ready in {_metrics['total_startup_s']:.2f}s ({_metrics['backend']} embeddings) "
+          f"(cold embed {_metrics['cold_embed_s'] or 0:.3f}s, warm embed {_metrics['warm_embed_s'] or 0:.3f}s)")
+    return mtcnn, resnet
+
+
+def get_models():
+    global _models
+    start = time.perf_counter()
+    if _models is None:
+        with _lock:
+            if _models is None:
+                _models = load_models()
+    _metrics['get_calls'] += 1
+    _metrics['last_get_s'] = time.perf_counter() - start
+    return _models
+
+
+def model_metrics():
+    return dict(_metrics)
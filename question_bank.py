@@ -0,0 +1,121 @@
+# Compiled question bank and deterministic per-candidate papers
+#
+# The bank is loaded from exam_store once and recompiled only when the store's
+# questions version changes (any edit in any process bumps it), so a Streamlit rerun
+# costs one tiny query instead of reloading every question. Compiling keeps the
+# question dicts as-is and builds NumPy arrays of answers and per-course, section and
+# difficulty positions for selection.
+#
+# A Paper is a candidate's own selection and ordering of questions, drawn from a seed
+# derived from EXAM_SEED and the username. It holds only question ids; option order
+# is derived per question from the same seed when rendered, so nothing from the bank
+# is copied per candidate. The ids are stored with the exam session so the paper
+# stays the same after a resume even if the bank has been edited since.
+
+import os
+import hashlib
+import threading
+import numpy as np
+from exam_store import get_exam_store
+
+EXAM_SEED = os.environ.get('CBT_EXAM_SEED', '')
+
+
+def paper_seed(username, exam_seed=EXAM_SEED):
+    # 63 bits so it fits an SQLite INTEGER
+    return int.from_bytes(hashlib.sha256(f'{exam_seed}:{username}'.encode('utf-8')).digest()[:8], 'little') >> 1
+
+
+class Paper:
+    def __init__(self, bank, ids, seed, shuffle_options=True):
+        self.bank = bank
+        self.seed = seed
+        self.shuffle_options = shuffle_options
+        # Questions deleted from the bank since the paper was drawn are dropped
+        self.ids = np.array([i for i in ids if i in bank.positions_by_id], dtype=np.int64)
+        self.positions = np.array([bank.positions_by_id[int(i)] for i in self.ids], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def question(self, index):
+        return self.bank.questions[self.positions[index]]
+
+    def option_order(self, index):
+        # Display position -> original option index, stable for this candidate and question
+        n = len(self.question(index)['options'])
+        if not self.shuffle_options:
+            return np.arange(n)
+        return np.random.default_rng([self.seed, int(self.ids[index]) & 0xFFFFFFFF]).permutation(n)
+
+    def questions(self):
+        return [self.question(i) for i in range(len(self))]
+
+
+class QuestionBank:
+    def __init__(self, questions, version=0):
+        self.version = version
+        self.questions = questions
+        self.ids = np.array([q['id'] for q in questions], dtype=np.int64)
+        self.answers = np.array([q['answer'] for q in questions], dtype=np.int8)
+        self.positions_by_id = {int(qid): pos for pos, qid in enumerate(self.ids)}
+        self.courses = self._codes('course')
+        self.sections = self._codes('section')
+        self.difficulties = self._codes('difficulty')
+
+    def _codes(self, field):
+        # {value: positions of the questions with that value}
+        values = np.array([q.get(field, '') for q in self.questions], dtype=object)
+        return {v: np.flatnonzero(values == v) for v in dict.fromkeys(values)}
+
+    def __len__(self):
+        return len(self.questions)
+
+    def positions(self, course=None, section=None, difficulty=None):
+        mask = np.ones(len(self.questions), dtype=bool)
+        for codes, value in ((self.courses, course), (self.sections, section), (self.difficulties, difficulty)):
+            if value is not None:
+                selected = np.zeros_like(mask)
+                selected[codes.get(value, [])] = True
+                mask &= selected
+        return np.flatnonzero(mask)
+
+    def paper(self, seed, course=None, size=None, per_section=None, shuffle_options=True):
+        # per_section: {section: count} draws that many from each section; otherwise
+        # `size` questions (all when None) from the course, in a seeded random order.
+        rng = np.random.default_rng(seed)
+        pool = self.positions(course)
+        if per_section:
+            chosen = []
+            for name, count in per_section.items():
+                available = np.intersect1d(pool, self.sections.get(name, []))
+                chosen.append(rng.choice(available, size=min(count, len(available)), replace=False, shuffle=False))
+            chosen = np.concatenate(chosen) if chosen else pool[:0]
+        elif size and size < len(pool):
+            chosen = rng.choice(pool, size=size, replace=False, shuffle=False)
+        else:
+            chosen = pool
+        chosen = rng.permutation(chosen)
+        return Paper(self, self.ids[chosen].tolist(), seed, shuffle_options)
+
+    def paper_from_ids(self, ids, seed, shuffle_options=True):
+        return Paper(self, ids, seed, shuffle_options)
+
+
+_cached_bank = None
+_cached_lock = threading.Lock()
+
+
+def get_question_bank(fallback=None):
+    # The bank is rebuilt only when the stored questions change. `fallback` (a list of
+    # question dicts without ids) is used when no questions have been set yet.
+    global _cached_bank
+    store = get_exam_store()
+    version = store.questions_version()
+    with _cached_lock:
+        if _cached_bank is None or _cached_bank.version != version:
+            questions = store.list_questions()
+            if not questions and fallback:
+                questions = [dict(q, id=-(i + 1)) for i, q in enumerate(fallback)]
+            _cached_bank = QuestionBank(questions, version)
+        return _cached_bank
@@ -0,0 +1,139 @@
+# Real-time face authentication for the main.py webcam loop
+#
+# MTCNN runs once per detection frame and its boxes are reused both for the face crop
+# and for drawing. Between detections the face is followed with a cheap template-match
+# tracker, and the ResNet embedding is only recomputed when a new face appears, the
+# tracker loses confidence, or an unrecognised face has been on screen for a while.
+
+import threading
+import cv2
+import numpy as np
+import torch
+from search import search_gallery
+from metrics import stage
+from detection import detect, crop
+
+DETECT_EVERY = 5          # full MTCNN pass every N frames while a face is tracked
+TRACK_MIN_SCORE = 0.6     # template-match score below which the track is dropped
+SAME_FACE_IOU = 0.5       # detection overlapping the track this much keeps its identity
+RETRY_UNKNOWN_EVERY = 15  # frames between re-embeddings of an unrecognised face
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class FaceTracker:
+    def __init__(self, gray, box, search_margin=0.5):
+        self.search_margin = search_margin
+        self.score = 1.0
+        self.reset(gray, box)
+
+    def reset(self, gray, box):
+        h, w = gray.shape[:2]
+        x1, y1, x2, y2 = [int(round(v)) for v in box]
+        x1, y1 = max(0, x1), max(0, y1)
+        x2, y2 = min(w, x2), min(h, y2)
+        self.box = np.array([x1, y1, x2, y2], dtype=np.float32)
+        self.template = gray[y1:y2, x1:x2].copy()
+        self.score = 1.0
+
+    def update(self, gray):
+        th, tw = self.template.shape[:2]
+        if th < 8 or tw < 8:
+            self.score = 0.0
+            return self.box, self.score
+        h, w = gray.shape[:2]
+        mx, my = int(tw * self.search_margin), int(th * self.search_margin)
+        x1, y1 = int(self.box[0]), int(self.box[1])
+        wx1, wy1 = max(0, x1 - mx), max(0, y1 - my)
+        wx2, wy2 = min(w, x1 + tw + mx), min(h, y1 + th + my)
+        region = gray[wy1:wy2, wx1:wx2]
+        if region.shape[0] < th or region.shape[1] < tw:
+            self.score = 0.0
+            return self.box, self.score
+        result = cv2.matchTemplate(region, self.template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, loc = cv2.minMaxLoc(result)
+        nx, ny = wx1 + loc[0], wy1 + loc[1]
+        self.box = np.array([nx, ny, nx + tw, ny + th], dtype=np.float32)
+        self.score = float(score)
+        return self.box, self.score
+
+
+class RealtimeAuthenticator:
+    def __init__(self, mtcnn, resnet, gallery, threshold, detect_every=DETECT_EVERY):
+        self.mtcnn = mtcnn
+        self.resnet = resnet
+        self.gallery = gallery
+        self.threshold = threshold
+        self.detect_every = detect_every
+        self.frame_index = 0
+        self.tracker = None
+        self.identity = None  # (name, similarity) for the tracked face
+        self.frames_since_embed = 0
+        self.stats = {'frames': 0, 'detections': 0, 'embeddings': 0, 'tracked_frames': 0}
+        # process() may run on the pipeline's inference thread while main.py calls reset()
+        self._lock = threading.RLock()
+
+    def reset(self):
+        with self._lock:
+            self.tracker = None
+            self.identity = None
+
+    def _embed(self, rgb, box):
+        with stage('camera', 'embed'):
+            face = crop(self.mtcnn, rgb, [box])
+            with torch.inference_mode():
+                emb = self.resnet(face.unsqueeze(0)).numpy()
+        self.stats['embeddings'] += 1
+        self.frames_since_embed = 0
+        with stage('camera', 'search'):
+            matches = search_gallery(self.gallery, emb, k=1)
+        return matches[0] if matches else (None, 0.0)
+
+    def process(self, rgb):
+        # Returns the face box (or None), its identity, and whether a new decision was made
+        with self._lock:
+            return self._process(rgb)
+
+    def _process(self, rgb):
+        self.stats['frames'] += 1
+        self.frame_index += 1
+        self.frames_since_embed += 1
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        box = None
+        needs_embed = False
+        if self.tracker is not None and self.frame_index % self.detect_every:
+            with stage('camera', 'track'):
+                box, score = self.tracker.update(gray)
+            if score < TRACK_MIN_SCORE:
+                self.reset()
+                box = None
+            else:
+                self.stats['tracked_frames'] += 1
+        if self.tracker is None or self.frame_index % self.detect_every == 0:
+            with stage('camera', 'detect'):
+                boxes, _ = detect(self.mtcnn, rgb)
+            self.stats['detections'] += 1
+            if boxes is None:
+                self.reset()
+                return {'box': None, 'name': None, 'similarity': 0.0, 'new_decision': False}
+            box = boxes[0]  # largest face first
+            if self.tracker is None or iou(self.tracker.box, box) < SAME_FACE_IOU:
+                needs_embed = True
+                self.tracker = FaceTracker(gray, box)
+            else:
+                self.tracker.reset(gray, box)
+        name, similarity = self.identity or (None, 0.0)
+        if self.identity is not None and similarity <= self.threshold \
+                and self.frames_since_embed >= RETRY_UNKNOWN_EVERY:
+            needs_embed = True
+        if needs_embed or self.identity is None:
+            name, similarity = self._embed(rgb, box)
+            self.identity = (name, similarity)
+            needs_embed = True
+        return {'box': box, 'name': name, 'similarity': similarity, 'new_decision': needs_embed}
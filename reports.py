@@ -0,0 +1,216 @@
+# Background PDF report jobs for the admin dashboard
+#
+# A job builds a zip archive on disk while the Streamlit script keeps running and
+# polls its progress. Rows are streamed from the event store in batches and written
+# into PDFs of at most ROWS_PER_PDF lines, so memory is bounded by one part rather
+# than the whole history. Per-student report cards are rendered in a process pool
+# (FPDF is pure Python) with at most MAX_IN_FLIGHT cards outstanding, and added to the
+# zip as they finish.
+#
+# Archives are named after the store version they were built from (results_version()
+# or auth_version()) and written atomically, so a finished report is reused, even
+# across restarts, until a result is recorded or deleted.
+
+import os
+import time
+import zipfile
+import threading
+import multiprocessing
+from itertools import groupby
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from event_store import get_event_store
+
+REPORTS_DIR = 'reports'
+ROWS_PER_PDF = 2000
+REPORT_WORKERS = int(os.environ.get('CBT_REPORT_WORKERS', 0)) or max(1, (os.cpu_count() or 2) - 1)
+MAX_IN_FLIGHT = REPORT_WORKERS * 4
+
+
+def _latin1(text):
+    # FPDF's core fonts only cover Latin-1
+    return str(text).encode('latin1', 'replace').decode('latin1')
+
+
+def _new_pdf(title):
+    from fpdf import FPDF
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font('Arial', size=12)
+    pdf.cell(200, 10, txt=_latin1(title), ln=True, align='C')
+    return pdf
+
+
+def _pdf_bytes(pdf):
+    return pdf.output(dest='S').encode('latin1')
+
+
+def report_card_pdf(username, rows):
+    # rows: (timestamp, score, total) for one student
+    from fpdf import FPDF
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font('Arial', 'B', 16)
+    pdf.cell(200, 10, _latin1(f"Report Card for {username}"), ln=True, align='C')
+    pdf.set_font('Arial', '', 12)
+    for ts, score, total in rows:
+        pdf.cell(200, 10, f"{ts} - Score: {score}/{total}", ln=True)
+    return _pdf_bytes(pdf)
+
+
+def _report_card_task(username, rows):
+    return username, report_card_pdf(username, rows)
+
+
+class ReportJob:
+    def __init__(self, kind, version, path):
+        self.kind = kind
+        self.version = version
+        self.path = path
+        self.state = 'pending'
+        self.done = 0
+        self.total = 0
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    @property
+    def progress(self):
+        if self.state == 'done':
+            return 1.0
+        return min(1.0, self.done / self.total) if self.total else 0.0
+
+    @property
+    def running(self):
+        return self.state in ('pending', 'running')
+
+    def start(self, build, store):
+        self._thread = threading.Thread(target=self._run, args=(build, store), name=f'report-{self.kind}',
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self, build, store):
+        self.state = 'running'
+        self.started = time.time()
+        tmp_path = self.path + '.tmp'
+        try:
+            with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+                build(store, zf, self)
+            os.replace(tmp_path, self.path)
+            self.state = 'done'
+            _remove_stale(self.kind, self.path)
+        except Exception as e:
+            self.error = str(e)
+            self.state = 'failed'
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.finished = time.time()
+
+
+def _remove_stale(kind, current):
+    # Archives of earlier versions are superseded once this one is built
+    for fname in os.listdir(os.path.dirname(current) or '.'):
+        path = os.path.join(os.path.dirname(current), fname)
+        if fname.startswith(f'{kind}_') and fname.endswith('.zip') and path != current:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # being downloaded on Windows; removed after the next build
+
+
+def _write_line_pdfs(zf, prefix, title, lines, job):
+    part, count, pdf = 0, 0, None
+    for line in lines:
+        if pdf is None:
+            part += 1
+            pdf = _new_pdf(f'{title} (part {part})')
+        pdf.cell(200, 8, txt=_latin1(line), ln=True)
+        count += 1
+        job.done += 1
+        if count == ROWS_PER_PDF:
+            zf.writestr(f'{prefix}_{part:03d}.pdf', _pdf_bytes(pdf))
+            pdf, count = None, 0
+    if pdf is not None:
+        zf.writestr(f'{prefix}_{part:03d}.pdf', _pdf_bytes(pdf))
+    elif part == 0:
+        pdf = _new_pdf(title)
+        pdf.cell(200, 8, txt='No records.', ln=True)
+        zf.writestr(f'{prefix}_001.pdf', _pdf_bytes(pdf))
+
+
+def build_auth_archive(store, zf, job):
+    job.total = store.auth_count()
+    lines = (f'{ts} - {username} - {status}' for ts, username, status in store.iter_auth())
+    _write_line_pdfs(zf, 'auth_log', 'Authentication Log', lines, job)
+
+
+def build_results_archive(store, zf, job):
+    users = store.result_users()
+    job.total = store.results_count() + len(users)
+    lines = (f'{ts} - {username} - Score: {score}/{total}' for ts, username, score, total in store.iter_results())
+    _write_line_pdfs(zf, 'results', 'CBT Results', lines, job)
+    if not users:
+        return
+    # Report cards: results arrive grouped by student; at most MAX_IN_FLIGHT are queued at once
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(REPORT_WORKERS, mp_context=context) as pool:
+        pending = set()
+        for username, rows in groupby(store.iter_results(by_user=True), key=lambda r: r[1]):
+            pending.add(pool.submit(_report_card_task, username, [(r[0], r[2], r[3]) for r in rows]))
+            if len(pending) >= MAX_IN_FLIGHT:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                _write_cards(zf, finished, job)
+        _write_cards(zf, pending, job)
+
+
+def _write_cards(zf, futures, job):
+    for future in futures:
+        username, data = future.result()
+        zf.writestr(f'report_cards/{_safe_name(username)}.pdf', data)
+        job.done += 1
+
+
+def _safe_name(name):
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name) or 'unnamed'
+
+
+BUILDERS = {
+    'auth_log': (build_auth_archive, lambda store: store.auth_version()),
+    'results': (build_results_archive, lambda store: store.results_version()),
+}
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def start_report_job(kind, store=None):
+    # Returns the job for the store's current version: running, finished, or just started
+    store = store or get_event_store()
+    build, version_of = BUILDERS[kind]
+    version = version_of(store)
+    with _jobs_lock:
+        job = _jobs.get(kind)
+        if job is not None and job.version == version and (job.running or _finished(job)):
+            return job
+        if not os.path.exists(REPORTS_DIR):
+            os.makedirs(REPORTS_DIR)
+        job = ReportJob(kind, version, os.path.join(REPORTS_DIR, f'{kind}_{version}.zip'))
+        _jobs[kind] = job
+        if os.path.exists(job.path):
+            job.state = 'done'
+        else:
+            job.start(build, store)
+        return job
+
+
+def _finished(job):
+    # Done and its archive is still on disk
+    return job.state == 'done' and os.path.exists(job.path)
+
+
+def get_report_job(kind):
+    # None once a finished job's archive has been deleted, so it is built again on request
+    with _jobs_lock:
+        job = _jobs.get(kind)
+        if job is not None and job.state == 'done' and not os.path.exists(job.path):
+            del _jobs[kind]
+            return None
+        return job
@@ -0,0 +1,263 @@
+# 1:N face search backends over the embedding gallery
+#
+# BruteForceIndex scores every enrolled user against pre-normalized rows (exact).
+# IVFIndex clusters the gallery with spherical k-means and only scores the rows in
+# the nprobe clusters closest to the query; raising nprobe trades speed for recall.
+# Both return the top-k row indices and cosine similarities for a batch of queries.
+#
+# Against a gallery, the index holds one centroid per user (the normalized mean of
+# their templates), so users with several enrolment photos cost one row each. The
+# best RERANK_K users are then re-scored by their best single template, which is the
+# similarity reported to callers.
+#
+# SEARCH_STORAGE (env CBT_SEARCH_STORAGE) sets how brute-force search stores the
+# centroids: 'float32' (in-process copy), or 'float16' / 'int8' codes (int8 with a
+# per-row scale) that a CompactIndex scores a chunk at a time. Compact codes are built
+# once per gallery revision and memory-mapped from gallery_dir by every process, so a
+# large gallery costs each worker 2x (float16) or ~4x (int8) less and the pages are
+# shared; the exact float32 template re-scoring above removes the quantization error
+# from the reported similarities. int8 is also the faster of the two to score, as
+# NumPy decodes float16 without SIMD.
+
+import os
+import numpy as np
+
+SEARCH_BACKEND = os.environ.get('CBT_SEARCH_BACKEND', 'auto')
+IVF_MIN_SIZE = 20000
+IVF_NPROBE = int(os.environ.get('CBT_IVF_NPROBE', 16))
+ASSIGN_CHUNK = 8192
+RERANK_K = 10
+SEARCH_STORAGE = os.environ.get('CBT_SEARCH_STORAGE', 'float32')
+STORAGE_DTYPES = {'float16': np.float16, 'int8': np.int8}
+
+
+def normalize(x):
+    x = np.atleast_2d(np.asarray(x, dtype=np.float32))
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def _top_k(scores, k):
+    # scores: (queries, candidates) -> indices and scores sorted best-first
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1)
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+def _nearest_centroid(x, centroids):
+    assign = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), ASSIGN_CHUNK):
+        assign[start:start + ASSIGN_CHUNK] = np.argmax(x[start:start + ASSIGN_CHUNK] @ centroids.T, axis=1)
+    return assign
+
+
+class BruteForceIndex:
+    name = 'brute'
+
+    def __init__(self):
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def build(self, embeddings):
+        self.vectors = normalize(embeddings) if len(embeddings) else np.zeros((0, 0), dtype=np.float32)
+        return self
+
+    def search(self, queries, k=1):
+        q = normalize(queries)
+        if not len(self.vectors):
+            return np.zeros((len(q), 0), dtype=np.int64), np.zeros((len(q), 0), dtype=np.float32)
+        return _top_k(q @ self.vectors.T, k)
+
+
+def quantize(x, storage):
+    # (codes, per-row scales) for normalized rows; scales are ones for float16
+    codes = np.empty(x.shape, dtype=STORAGE_DTYPES[storage])
+    scales = np.ones(len(x), dtype=np.float32)
+    for start in range(0, len(x), ASSIGN_CHUNK):
+        block = np.asarray(x[start:start + ASSIGN_CHUNK], dtype=np.float32)
+        if storage == 'int8':
+            scale = np.abs(block).max(axis=1) / 127.0
+            scale[scale == 0] = 1.0
+            scales[start:start + len(block)] = scale
+            block = np.round(block / scale[:, None])
+        codes[start:start + len(block)] = block
+    return codes, scales
+
+
+class CompactIndex:
+    # Brute force over float16 or int8 codes, decoded ASSIGN_CHUNK rows at a time
+    name = 'compact'
+
+    def __init__(self, storage='float16'):
+        self.storage = storage
+        self.codes = np.zeros((0, 0), dtype=STORAGE_DTYPES[storage])
+        self.scales = np.zeros(0, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def build(self, embeddings):
+        if len(embeddings):
+            self.codes, self.scales = quantize(normalize(embeddings), self.storage)
+        return self
+
+    def load(self, codes, scales):
+        # e.g. memmaps shared between processes
+        self.codes, self.scales = codes, scales
+        return self
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    def search(self, queries, k=1):
+        q = normalize(queries)
+        if not len(self.codes):
+            return np.zeros((len(q), 0), dtype=np.int64), np.zeros((len(q), 0), dtype=np.float32)
+        scores = np.empty((len(q), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), ASSIGN_CHUNK):
+            block = np.asarray(self.codes[start:start + ASSIGN_CHUNK], dtype=np.float32)
+            scores[:, start:start + len(block)] = (q @ block.T) * self.scales[start:start + len(block)]
+        return _top_k(scores, k)
+
+
+class IVFIndex:
+    name = 'ivf'
+
+    def __init__(self, nlist=None, nprobe=IVF_NPROBE, train_iters=10, train_sample=256, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iters = train_iters
+        self.train_sample = train_sample
+        self.seed = seed
+        self.centroids = None
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def _train(self, x, nlist):
+        rng = np.random.default_rng(self.seed)
+        sample = x
+        if len(x) > nlist * self.train_sample:
+            sample = x[rng.choice(len(x), nlist * self.train_sample, replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(self.train_iters):
+            assign = _nearest_centroid(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # Re-seed empty clusters from random points so every list stays useful
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+            centroids = normalize(sums)
+        return centroids
+
+    def build(self, embeddings, centroids=None):
+        # Pass the centroids of a previous build to skip re-training after small gallery changes
+        if not len(embeddings):
+            self.__init__(self.nlist, self.nprobe, self.train_iters, self.train_sample, self.seed)
+            return self
+        x = normalize(embeddings)
+        nlist = min(self.nlist or max(1, int(round(np.sqrt(len(x))))), len(x))
+        if centroids is None or len(centroids) != nlist:
+            centroids = self._train(x, nlist)
+        self.centroids = centroids
+        assign = _nearest_centroid(x, centroids)
+        # Store each inverted list as one contiguous slice of the reordered matrix
+        order = np.argsort(assign, kind='stable')
+        self.vectors = x[order]
+        self.ids = order
+        self.offsets = np.searchsorted(assign[order], np.arange(nlist + 1))
+        return self
+
+    def search(self, queries, k=1, nprobe=None):
+        q = normalize(queries)
+        if not len(self.vectors):
+            return np.zeros((len(q), 0), dtype=np.int64), np.zeros((len(q), 0), dtype=np.float32)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probes, _ = _top_k(q @ self.centroids.T, nprobe)
+        out_idx = np.full((len(q), k), -1, dtype=np.int64)
+        out_scores = np.full((len(q), k), -np.inf, dtype=np.float32)
+        for qi in range(len(q)):
+            ranges = [np.arange(self.offsets[c], self.offsets[c + 1]) for c in probes[qi]]
+            rows = np.concatenate(ranges)
+            if not len(rows):
+                continue
+            idx, scores = _top_k((self.vectors[rows] @ q[qi])[None, :], k)
+            n = idx.shape[1]
+            out_idx[qi, :n] = self.ids[rows[idx[0]]]
+            out_scores[qi, :n] = scores[0]
+        return out_idx, out_scores
+
+
+def make_index(backend=SEARCH_BACKEND, size=0, storage=SEARCH_STORAGE, **params):
+    if backend == 'auto':
+        backend = 'ivf' if size >= IVF_MIN_SIZE else 'brute'
+    if backend == 'brute':
+        return BruteForceIndex() if storage == 'float32' else CompactIndex(storage)
+    if backend == 'ivf':
+        return IVFIndex(**params)
+    raise ValueError(f'Unknown search backend: {backend}')
+
+
+# --- Gallery integration ---
+_index_cache = {}
+
+
+def _shared_compact_index(gallery, storage):
+    def build():
+        codes, scales = quantize(gallery.centroids(cache=False)[1], storage)
+        return {'codes': codes, 'scales': scales}
+    arrays = gallery.cached_arrays(f'centroids_{storage}', ('codes', 'scales'), build)
+    return CompactIndex(storage).load(arrays['codes'], arrays['scales'])
+
+
+def get_index(gallery, backend=SEARCH_BACKEND, storage=SEARCH_STORAGE):
+    # Index over per-user centroids, rebuilt only when the gallery changes; IVF keeps
+    # its trained cluster centroids across rebuilds
+    key = (id(gallery), backend, storage)
+    cached = _index_cache.get(key)
+    if cached is not None and cached[0] == gallery.version:
+        return cached[1]
+    size = len(gallery.centroid_names())
+    if storage != 'float32' and (backend == 'brute' or backend == 'auto' and size < IVF_MIN_SIZE):
+        index = _shared_compact_index(gallery, storage)
+        _index_cache[key] = (gallery.version, index)
+        return index
+    _, embeddings = gallery.centroids(cache=False)  # the index keeps its own normalized copy
+    index = make_index(backend, size=len(embeddings), storage=storage)
+    if cached is not None and isinstance(index, IVFIndex) and isinstance(cached[1], IVFIndex):
+        index.build(embeddings, centroids=cached[1].centroids)
+    else:
+        index.build(embeddings)
+    _index_cache[key] = (gallery.version, index)
+    return index
+
+
+def search_gallery(gallery, emb, k=1, backend=SEARCH_BACKEND, storage=SEARCH_STORAGE):
+    # Returns [(name, similarity), ...] best-first for a single query embedding, one
+    # entry per user, scored by the user's closest template
+    index = get_index(gallery, backend, storage)
+    idx, _ = index.search(emb, max(k, RERANK_K))
+    names = gallery.centroid_names()
+    query = normalize(emb)[0]
+    matches = []
+    for i in idx[0]:
+        if i >= 0:
+            templates = gallery.get(names[i])
+            if len(templates):
+                matches.append((names[i], float((normalize(templates) @ query).max())))
+    matches.sort(key=lambda m: -m[1])
+    return matches[:k]
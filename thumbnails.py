@@ -0,0 +1,32 @@
+# Cached thumbnails of enrolment photos for the admin pages
+#
+# Thumbnails are small JPEGs under THUMB_DIR named by the source photo's sha1 (already
+# recorded in the gallery index), so they are generated once on first display, shared
+# by identical photos, and a changed photo simply gets a new one. Only the thumbnails
+# for the page being shown are ever generated.
+
+import os
+import cv2
+from gallery import GALLERY_DIR
+
+THUMB_DIR = os.path.join(GALLERY_DIR, 'thumbs')
+THUMB_SIZE = 96
+
+
+def thumbnail(path, sha1, size=THUMB_SIZE, thumb_dir=THUMB_DIR):
+    # Path of the cached thumbnail, created on first use; None if the photo can't be read
+    thumb = os.path.join(thumb_dir, f'{sha1}_{size}.jpg')
+    if os.path.exists(thumb):
+        return thumb
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    scale = size / max(img.shape[:2])
+    if scale < 1:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if not os.path.exists(thumb_dir):
+        os.makedirs(thumb_dir, exist_ok=True)
+    tmp_path = f'{thumb}.{os.getpid()}.tmp.jpg'
+    cv2.imwrite(tmp_path, img, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    os.replace(tmp_path, thumb)
+    return thumb